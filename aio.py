@@ -0,0 +1,90 @@
+# asyncio front end to the link API, for callers that want to fan work out (metadata for many ids, several users'
+# collections, many pages of plays) with asyncio.gather instead of managing threads themselves.
+#
+# Requests still go through the shared transport, so the connection pool, rate limiter, retry policy and circuit
+# breaker are the same ones the synchronous API uses; the blocking calls just run on a bounded executor.
+
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import link
+
+from model import Game, CollectionItem
+
+class Client:
+    def __init__(self, concurrency: int = link.concurrency):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="bgg-aio")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def _call(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def get_games(self, name: str) -> List[dict]:
+        return await self._call(link.get_games, name)
+
+    async def get_game(self, id: Union[int, str], refresh: bool = False) -> Optional[Game]:
+        return await self._call(link.get_game, id, refresh=refresh)
+
+    async def get_games_by_id(
+        self, 
+        ids: Iterable[Union[int, str]], 
+        batch_size: int = 20, 
+        refresh: bool = False
+    ) -> Dict[int, Game]:
+        ids = list(dict.fromkeys(int(i) for i in ids))
+        chunks = await asyncio.gather(*(
+            self._call(link.get_games_by_id, ids[i:i+batch_size], batch_size=batch_size, refresh=refresh)
+            for i in range(0, len(ids), batch_size)
+        ))
+        return {gid: game for chunk in chunks for gid, game in chunk.items()}
+
+    async def fetch_plays(self, username: str, min_date: Optional[str] = None) -> List[dict]:
+        # Same page planning as link.fetch_plays, with the remaining pages gathered instead of mapped over a pool
+        meta = {}
+        first = await self._call(link.read_plays_page, username, 1, min_date, meta)
+        rest = await asyncio.gather(*(
+            self._call(link.read_plays_page, username, page, min_date)
+            for page in link.remaining_plays_pages(meta)
+        ))
+
+        return first + [play for page in rest for play in page]
+
+    async def get_plays(self, days=30, sync: bool = True) -> List[dict]:
+        return await self._call(link.get_plays, days, sync=sync)
+
+    async def get_play_columns(self, days=30, sync: bool = True) -> Dict[str, list]:
+        return await self._call(link.get_play_columns, days, sync=sync)
+
+    async def get_collection(self, username: str, sync: bool = True) -> Tuple[List[CollectionItem], List[CollectionItem]]:
+        return await self._call(link.get_collection, username, sync=sync)
+
+    async def get_collections(self, usernames: Iterable[str]) -> Dict[str, Tuple[List[CollectionItem], List[CollectionItem]]]:
+        usernames = list(dict.fromkeys(usernames))
+        collections = await asyncio.gather(*(self.get_collection(u) for u in usernames))
+        return dict(zip(usernames, collections))
+
+    async def log_play(self, gid, plays=1, comment="", playdate: Optional[str] = None):
+        return await self._call(link.log_play, gid, plays=plays, comment=comment, playdate=playdate)
+
+    async def wishlist_game(self, gid: int, name: str, priority: int, comment: Optional[str] = None):
+        return await self._call(link.wishlist_game, gid, name, priority, comment=comment)
+
+    async def update_status(self, cid: int, gid: int, owned: bool, **kwargs):
+        return await self._call(link.update_status, cid, gid, owned, **kwargs)
+
+    async def update_comment(self, cid: int, gid: int, comment: str = "", wishlist: bool = False):
+        return await self._call(link.update_comment, cid, gid, comment, wishlist=wishlist)
+
+    async def delete_item(self, cid: int):
+        return await self._call(link.delete_item, cid)
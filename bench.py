@@ -0,0 +1,243 @@
+# Benchmarks for the parts of BoredGamer that need to stay fast. Run `python bench.py -h` for the available suites.
+
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from typing import Callable, List
+
+import xmltodict
+
+import mockbgg
+import xmlstream
+from model import Game, CollectionItem, WishlistMetadata
+from utils import *
+
+def xmltodict_plays(content: bytes) -> List[dict]:
+    data = xmltodict.parse(content)
+    return [{
+        'id': int(p['@id']),
+        'date': p['@date'],
+        'plays': int(p['@quantity']),
+        'game_id': int(p['item']['@objectid']),
+        'name': p['item']['@name'],
+        'comments': p.get('comments'),
+    } for p in data['plays']['play']]
+
+def xmltodict_collection(content: bytes) -> List[CollectionItem]:
+    data = xmltodict.parse(content)
+    output = []
+    for item in data['items']['item']:
+        model = CollectionItem(
+            id=int(item['@collid']),
+            comment=item.get('comment'),
+            game=Game(name=item['name']['#text'], id=int(item['@objectid'])),
+            owned=item['status']['@own'] == '1'
+        )
+        if item['status']['@wishlist'] == '1':
+            model.wishlist = WishlistMetadata(
+                priority=int(item['status']['@wishlistpriority']),
+                comment=item.get('wishlistcomment')
+            )
+        output.append(model)
+
+    return output
+
+def measure(fn: Callable[[], object], repeat: int = 3) -> tuple:
+    """Returns (best wall time in seconds, peak traced memory in bytes) for fn"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak
+
+def report(name: str, seconds: float, peak: int):
+    print(f"  {name:<28} {seconds * 1000:>9.1f} ms {peak / 2**20:>9.1f} MiB peak")
+
+def bench_parse(args):
+    fixtures = mockbgg.Fixtures(args.plays, args.items)
+
+    # Consuming the generator without keeping results is the streaming case (e.g. an export); collecting into a
+    # list is what the CLI does when it needs everything at once
+    consume = lambda it: [None for _ in it]
+    for label, content, baseline, streaming in [
+        ("plays", fixtures.plays_xml("bench", 1, page_size=args.plays).encode(), xmltodict_plays, xmlstream.iter_plays),
+        ("collection", fixtures.collection_xml(stats=True).encode(), xmltodict_collection, xmlstream.iter_collection),
+    ]:
+        print(f"{bold(label)} ({len(content) / 2**20:.1f} MiB of XML)")
+        report("xmltodict", *measure(lambda: baseline(content)))
+        report("xmlstream (list)", *measure(lambda: list(streaming(io.BytesIO(content)))))
+        report("xmlstream (streamed)", *measure(lambda: consume(streaming(io.BytesIO(content)))))
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def bench_link(args):
+    import tempfile
+
+    import httpcache
+    import link
+    import session
+    import store
+    import transport
+
+    server = mockbgg.start(
+        mockbgg.Fixtures(args.plays, args.items),
+        mockbgg.Options(args.latency, args.jitter, args.error_rate, args.throttle_rate, args.queue)
+    )
+
+    # Point everything at the mock, with throwaway local state
+    home = tempfile.mkdtemp(prefix="bgg-bench-")
+    link.bgg_api, link.bgg_site = f"{server.url}/xmlapi2", server.url
+    session.login_url = f"{server.url}/login/api/v1"
+    with open(os.path.join(home, "bgg.json"), "w") as jf:
+        json.dump({"username": "bench", "password": "bench"}, jf)
+    session.manager = session.SessionManager(os.path.join(home, "bgg.json"), os.path.join(home, "session.json"))
+
+    db = os.path.join(home, "bgg.db")
+    link.game_store, link.play_store = store.GameStore(db), store.PlayStore(db)
+    link.collection_store, link.title_store = store.CollectionStore(db), store.TitleStore(db)
+    httpcache.cache = httpcache.ResponseCache(os.path.join(home, "http-cache.db"))
+
+    if args.rate:
+        transport.limiter = transport.TokenBucket(args.rate, args.burst)
+    else:
+        transport.limiter = transport.TokenBucket(float("inf"), float("inf"))
+
+    game_ids = [item["game"] for item in server.fixtures.items.values()][:args.ids]
+    collids = list(server.fixtures.items)
+
+    # (name, function, items handled per call, calls, whether to empty the response cache before each call). Cases
+    # that measure the network start every call cold, otherwise only the first call would make any requests
+    cases = [
+        ("get_games", lambda: link.get_games("Ancient"), None, args.calls, True),
+        ("get_games (http cache)", lambda: link.get_games("Ancient"), None, args.calls, False),
+        ("get_games_by_id (network)", lambda: link.get_games_by_id(game_ids, refresh=True), len(game_ids), args.repeat, True),
+        ("get_games_by_id (store)", lambda: link.get_games_by_id(game_ids), len(game_ids), args.repeat, False),
+        ("fetch_plays", lambda: link.fetch_plays("bench"), args.plays, args.repeat, True),
+        ("iter_plays", lambda: sum(1 for _ in link.iter_plays("bench")), args.plays, args.repeat, True),
+        ("fetch_collection", lambda: link.fetch_collection("bench"), args.items, args.repeat, True),
+        ("sync_collection (full)", lambda: link.sync_collection("bench", full=True), args.items, args.repeat, True),
+        ("sync_collection (delta)", lambda: link.sync_collection("bench", max_age=0), None, args.repeat, True),
+        ("get_collection (snapshot)", lambda: link.get_collection("bench", sync=False), args.items, args.repeat, False),
+        ("log_play", lambda: link.log_play(game_ids[0]), None, args.calls, False),
+        ("update_comment", lambda: link.update_comment(collids[0], game_ids[0], "[Audit]"), None, args.calls, False),
+    ]
+
+    selected = [c for c in cases if not args.only or any(o in c[0] for o in args.only)]
+    print(f"{'':<28} {'calls':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'items/s':>10} {'requests':>8} {'peak':>9}")
+    for name, fn, items, calls, cold in selected:
+        before = sum(server.requests.values())
+        latencies = []
+        for _ in range(calls):
+            if cold:
+                httpcache.cache.clear()
+            start = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - start)
+        requests_per_call = (sum(server.requests.values()) - before) / calls
+
+        if cold:
+            httpcache.cache.clear()
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        throughput = f"{items * calls / sum(latencies):>10.0f}" if items else f"{calls / sum(latencies):>8.0f}/s"
+        print(
+            f"{name:<28} {calls:>5} " +
+            " ".join(f"{percentile(latencies, q) * 1000:>6.1f} ms" for q in (0.5, 0.95, 0.99)) +
+            f" {throughput} {requests_per_call:>8.1f} {peak / 2**20:>5.1f} MiB"
+        )
+
+    server.shutdown()
+
+# Modules that `bgg --help` must never pull in; each one is tens of milliseconds on its own
+heavy_modules = {"requests", "urllib3", "xmltodict", "simple_term_menu", "readline", "matplotlib", "numpy", "sqlite3"}
+
+def bench_startup(args):
+    command = [sys.executable, "-X", "importtime", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bgg.py"), "--help"]
+
+    timings, imports = [], []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        process = subprocess.run(command, capture_output=True, text=True)
+        timings.append(time.perf_counter() - start)
+
+        if process.returncode != 0:
+            print(process.stderr)
+            exit(1)
+
+        # -X importtime lines look like "import time: self [us] | cumulative | <indented module name>"
+        imports = []
+        for line in process.stderr.splitlines():
+            if line.startswith("import time:") and not line.endswith("imported package"):
+                _, cumulative, name = line[len("import time:"):].split("|")
+                if cumulative.strip().isdigit():
+                    imports.append((int(cumulative), name.rstrip()))
+
+    median = statistics.median(timings) * 1000
+    print(f"{bold('bgg --help')}: median {median:.1f} ms over {args.runs} runs (budget {args.budget:.0f} ms)")
+    print("Slowest top-level imports:")
+    for cumulative, name in sorted((i for i in imports if not i[1].startswith("  ")), reverse=True)[:args.top]:
+        print(f"  {name.strip():<28} {cumulative / 1000:>7.1f} ms")
+
+    loaded = sorted({name.strip().split(".")[0] for _, name in imports} & heavy_modules)
+    failed = False
+    if loaded:
+        print(f"{colr('Heavy modules imported', Role.ERROR)} by bgg --help: {', '.join(loaded)}")
+        failed = True
+    if median > args.budget:
+        print(f"{colr('Startup over budget', Role.ERROR)}: {median:.1f} ms > {args.budget:.0f} ms")
+        failed = True
+
+    exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='bench', description="BoredGamer benchmarks")
+    suites = parser.add_subparsers(dest='suite', required=True)
+
+    parse = suites.add_parser('parse', help="compare xmltodict against the streaming parsers")
+    parse.add_argument('--plays', type=int, default=10000, help="number of synthetic plays")
+    parse.add_argument('--items', type=int, default=5000, help="number of synthetic collection items")
+    parse.set_defaults(run=bench_parse)
+
+    mock = suites.add_parser('link', help="time each link function against a local mock BoardGameGeek")
+    mock.add_argument('--plays', type=int, default=10000, help="number of synthetic plays")
+    mock.add_argument('--items', type=int, default=5000, help="number of synthetic collection items")
+    mock.add_argument('--ids', type=int, default=600, help="number of games to fetch metadata for")
+    mock.add_argument('--repeat', type=int, default=5, help="calls per bulk function")
+    mock.add_argument('--calls', type=int, default=50, help="calls per single-item function")
+    mock.add_argument('--latency', type=float, default=0.02, help="mock latency per request, in seconds")
+    mock.add_argument('--jitter', type=float, default=0.01, help="random +/- variation on the latency, in seconds")
+    mock.add_argument('--error-rate', type=float, default=0, help="fraction of requests answered with a 503")
+    mock.add_argument('--throttle-rate', type=float, default=0, help="fraction of requests answered with a 429")
+    mock.add_argument('--queue', type=int, default=1, help="number of 202 responses before a collection is ready")
+    mock.add_argument('--rate', type=float, default=0, help="client rate limit in requests/s (0 for none)")
+    mock.add_argument('--burst', type=float, default=4, help="client rate limit burst size")
+    mock.add_argument('--only', nargs='+', help="only run functions whose name contains one of these")
+    mock.set_defaults(run=bench_link)
+
+    startup = suites.add_parser('startup', help="time a cold `bgg --help` and fail if it regresses past a budget")
+    startup.add_argument('--runs', type=int, default=10, help="number of fresh interpreters to time")
+    startup.add_argument('--budget', type=float, default=150, help="maximum median wall time, in milliseconds")
+    startup.add_argument('--top', type=int, default=10, help="number of slowest imports to list")
+    startup.set_defaults(run=bench_startup)
+
+    args = parser.parse_args()
+    args.run(args)
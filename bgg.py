@@ -1,22 +1,21 @@
 import argparse
-import json
-import webbrowser
-import readline
-import textwrap
+import os
+import sys
 
 from enum import Enum
 
-from simple_term_menu import TerminalMenu
-
-import link, tags
 from utils import *
 
-selected = None
+# Each command imports what it needs when it runs, so `bgg --help` or `bgg -o` don't pay for the network stack
+# (requests, xmltodict), the menus or readline. `python bench.py startup` keeps an eye on this.
+
+def describe_game(game: dict) -> str:
+    year = f" ({game['year']})" if game.get('year') else ""
+    return f'{game["name"]}{year} - ID: {game["idx"]}'
 
-class Reversor:
-    def __init__(self, value): self.value =value
-    def __eq__(self, oth): return oth.value == self.value
-    def __lt__(self, oth): return oth.value < self.value
+def describe_item(name: str, metadata) -> str:
+    # Metadata can be missing, e.g. offline for a game that was never fetched
+    return f"{name} - {metadata.format_metadata()}" if metadata is not None else name
 
 class CollectionUpdate(Enum):
     OPEN_PAGE = "View on BGG"
@@ -30,6 +29,15 @@ class CollectionUpdate(Enum):
 L_CollectionUpdate = list(CollectionUpdate)
 V_CollectionUpdate = [v.value for v in L_CollectionUpdate]
 
+# Menu entries that are just a bulk.py action applied to one item
+tag_actions = {
+    CollectionUpdate.MARK_RETURNED: "returned",
+    CollectionUpdate.MARK_AUDIT: "audit",
+    CollectionUpdate.MARK_GIVEAWAY: "giveaway",
+    CollectionUpdate.MARK_KEEP: "keep",
+    CollectionUpdate.CLEAR_TAGS: "clear",
+}
+
 class WishlistUpdate(Enum):
     OPEN_PAGE = "View on BGG"
     MARK_OWNED = "Mark Owned"
@@ -40,346 +48,565 @@ class WishlistUpdate(Enum):
 L_WishlistUpdate = list(WishlistUpdate)
 V_WishlistUpdate = [v.value for v in L_WishlistUpdate]
 
-if __name__ == '__main__':
-    try:
-        try: 
-            with open(cache_path, 'r') as cf: 
-                cache = json.load(cf)
-        except FileNotFoundError:
-            cache = {}
-
-        parser = argparse.ArgumentParser(
-            prog='bgg', 
-            description="Various utilities for BoardGameGeek logging",
-            allow_abbrev=True, 
-        )
-
-        mutex = parser.add_mutually_exclusive_group()
-        mutex.add_argument('-a', '--add', nargs='+', metavar=('title', '?plays'), help="add plays by title")
-        mutex.add_argument('-s', '--summary', nargs='*', metavar=('?days', '?filter'), const=None, help='get game summary for last # of days (or full history if omitted)')
-        mutex.add_argument('-l', '--login', action='store_true', help="login to a BoardGameGeek account")
-        mutex.add_argument('-o', '--open', action='store_true', help='open logged in BoardGameGeek account')
-        mutex.add_argument('-r', '--reset-cache', action='store_true', help="reset stored search cache information")
-
-        mutex.add_argument('-c', '--collection', action="store_true", help="interface with user collection")
-        mutex.add_argument('--lookup', nargs=1, help="lookup user collection")
-
-        parser.add_argument('-n', '--nocache', action='store_true', help='ignore cache')
-        parser.add_argument('-m', '--sortmode', default='plays', const='plays', nargs='?', choices=['title', 'plays'], help='mode to sort summary by')
-        parser.add_argument('-w', '--wishlist', action='store_true', help='add to wishlist')
-        parser.add_argument('--comment', nargs='?', help='contextual comment')
-        parser.add_argument('--filters', nargs=1, help="filters for collection")
-
-        args = vars(parser.parse_args())
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='bgg', 
+        description="Various utilities for BoardGameGeek logging",
+        epilog="Run `bgg serve` to keep a warm background daemon that other bgg commands will use when available",
+        allow_abbrev=True, 
+    )
+
+    mutex = parser.add_mutually_exclusive_group()
+    mutex.add_argument('-a', '--add', nargs='+', metavar=('title', '?plays'), help="add plays by title")
+    mutex.add_argument('-s', '--summary', nargs='*', metavar=('?days', '?filter'), const=None, help='get game summary for last # of days (or full history if omitted)')
+    mutex.add_argument('-l', '--login', action='store_true', help="login to a BoardGameGeek account")
+    mutex.add_argument('-o', '--open', action='store_true', help='open logged in BoardGameGeek account')
+    mutex.add_argument('-r', '--reset-cache', action='store_true', help="reset stored search cache information")
+
+    mutex.add_argument('--export', nargs=2, metavar=('plays|collection', 'file'), help="stream play history or collection to a .csv, .jsonl or .parquet file ('-' for stdout)")
+    mutex.add_argument('-c', '--collection', action="store_true", help="interface with user collection")
+    mutex.add_argument('--lookup', nargs='+', metavar='user', help="lookup user collections (games owned by any of them, with owners, for several)")
+
+    parser.add_argument('-n', '--nocache', action='store_true', help='ignore cache')
+    parser.add_argument('-m', '--sortmode', default='plays', const='plays', nargs='?', choices=['title', 'plays'], help='mode to sort summary by')
+    parser.add_argument('-w', '--wishlist', action='store_true', help='add to wishlist')
+    parser.add_argument('--comment', nargs='?', help='contextual comment')
+    parser.add_argument('--filters', nargs=1, metavar='query', help="tag query for collection, e.g. 'Loaned=Alice' or 'Audit AND NOT Loaned'")
+    parser.add_argument('--owned', choices=['any', 'all', 'one'], default='any', help="with --lookup, games owned by any, all or exactly one of the users")
+    parser.add_argument('--wanted', action='store_true', help="with --lookup, only games on your wishlist")
+    parser.add_argument('--bulk', metavar='action', help="with -c, apply audit, giveaway, keep, returned, clear or loaned=<name> to every item matching --filters/--ids")
+    parser.add_argument('--ids', nargs=1, metavar='ids', help="with --bulk, comma-separated collection or game ids to apply it to")
+    parser.add_argument('--format', choices=['csv', 'jsonl', 'parquet'], help="with --export, file format (guessed from the extension otherwise)")
+    parser.add_argument('--offline', action='store_true', help="answer from stored and cached BGG responses only; changes are queued until the next online run")
+    parser.add_argument('--profile', action='store_true', help="print a breakdown of requests, cache hits and parse time afterwards")
+    parser.add_argument('--trace', metavar='file', help="append every request, cache lookup and parse as JSON lines to file")
+
+    return parser
+
+def reset_cache():
+    from store import SelectionStore
+
+    print("Clearing stored play cache!")
+    SelectionStore(legacy=None).clear()
+    try: 
+        os.remove(cache_path)
+    except OSError as e:
+        pass
+
+    import httpcache
+    httpcache.get_cache().clear()
+
+def login():
+    import credentials
+    credentials.login()
+
+def add_play(args: dict, parser: argparse.ArgumentParser):
+    import readline
+
+    from datetime import date
+
+    from simple_term_menu import TerminalMenu
+
+    import daemon, journal, titles
+
+    from store import SelectionStore
+
+    # The warm daemon if `bgg serve` is running, otherwise link itself
+    api = daemon.backend()
+
+    # Send anything left queued by a previous run that couldn't reach BGG
+    journal.replay()
+
+    selections = SelectionStore()
+
+    add, s_wishlist = args.get('add'), args.get('wishlist')
+    selected = None
+
+    default = True
+    plays = 1
+    if len(add) == 2:
+        try:
+            plays = int(add[1])
+            if plays < 1: raise ValueError
+        except ValueError:
+            parser.error("Add argument must be a positive number (preferably an integer)!")
+        finally: 
+            default = False
+    
+    use_cache = not args.get('nocache')
+    title = add[0].lower()
+    cached = selections.get(title) if use_cache else None
+    if cached and cached['count'] >= 3:
+        selected = cached
+    else:
+        # Try titles we've seen before first, and only hit /search if nothing matches well (or if asked to)
+        game_options = titles.TitleIndex().resolve(title) if use_cache else []
+        search_more = bool(game_options)
+        while selected is None:
+            if not game_options:
+                game_options = api.get_games(title)
+                search_more = False
+
+            if not game_options:
+                print("No items found!")
+                break
+
+            game_items = [describe_game(game) for game in game_options]
+            if search_more:
+                game_items.append(f"Search BoardGameGeek for '{title}'...")
+
+            sidx = TerminalMenu(game_items, menu_highlight_style=("bg_cyan", "fg_black")).show()
+            if not isinstance(sidx, int):
+                break
+            elif sidx == len(game_options):
+                game_options = []
+            else:
+                selected = game_options[sidx]
+
+    if selected is None:
+        return
+
+    if s_wishlist:
+        plays = 4 if default else min(plays, max(plays, 1), 5)
         
-        add, summary, lookup, s_wishlist = (
-            args.get(v) for v in ['add', 'summary', 'lookup', 'wishlist']
-        )
+        user = api.get_user()
+        print(f"Checking {magenta(user)} collection to avoid duplicates...")
 
-        filters = [v for v in (args.get("filters") or [''])[0].split(",") if v]
+        _collection, _wishlist = api.get_collection(user)
+        filter_cond = lambda item: int(selected['idx']) == item.game.id
+        r_collection, r_wishlist = list(filter(filter_cond, _collection)), list(filter(filter_cond, _wishlist))
         
-        no_args = True
-        if args.get('reset_cache'): 
-            no_args = False
-            try: 
-                print("Clearing stored play cache!")
-                os.remove(cache_path)
-            except OSError as e:
-                pass
-
-        if args.get('login'):
-            link.login()
-        elif add is not None:
-            default = True
-            plays = 1
-            if len(add) == 2:
-                try:
-                    plays = int(add[1])
-                    if plays < 1: raise ValueError
-                except ValueError:
-                    parser.error("Add argument must be a positive number (preferably an integer)!")
-                finally: 
-                    default = False
-            
-            use_cache = not args.get('nocache')
-            title = add[0].lower()
-            game_options = link.get_games(title)
-            if use_cache and title in cache and cache[title]['count'] >= 3:
-                selected = cache[title]
+        if r_wishlist:
+            relevant = r_wishlist[0]
+            print(f"Found {colr(relevant.game.name, Role.GAME)} on wishlist @ {bold(relevant.wishlist.priority)}, with comment: '{bold(relevant.wishlist.comment or '')}'.\n")
+            if "y" == input(f"Update metadata ({bold('y/n')})? "):
+                # This should probably use the /collectionitems/{cid} endpoint, but that requires
+                # much more work than just hitting update_status, update_comment
+                
+                # only update comment if one exists; usually, this is a matter of updating wishlist 
+                # position, so updating comment with "" is not desired behavior...the old comment
+                if args.get("comment") is not None:    
+                    journal.submit("update_comment", relevant.id, relevant.game.id, args.get("comment"), wishlist=True)
+                
+                if relevant.wishlist.priority != plays:
+                    journal.submit("update_status", relevant.id, relevant.game.id, False, wishlist_priority=plays)
+        elif r_collection:
+            print("Item already exists in collection; ignoring...")
+            exit(0)
+        else:
+            journal.submit(
+                "wishlist_game",
+                selected['idx'],
+                selected['name'], 
+                priority=plays,
+                comment=args.get('comment')
+            )
+    else:
+        year = f" ({selected['year']})" if selected.get('year') else ""
+        print(f"Adding {colr(plays, Role.PLAY)} {'plays' if plays > 1 else 'play'} to {colr(selected['name'], Role.GAME)}{year}...")
+        try:
+            # Failures are reported by the journal; a play that couldn't be sent stays queued for the next run. The
+            # date is fixed now so that a play sent on a later run is still logged on the day it was played
+            entry = journal.submit("log_play", selected['idx'], plays=plays, comment=args.get('comment'), playdate=date.today().isoformat())
+            outcome = journal.wait(entry)
+            if outcome is journal.Outcome.SENT:
+                print(f"{colr('Plays added', Role.SUCCESS)}!" if plays > 1 else 'Play added!')
             else:
-                if not game_options:
-                    print("No items found!")
-                else:
-                    game_items = [f'{game["name"]} ({game["year"]}) - ID: {game["idx"]}' for game in game_options]
-                    sidx = TerminalMenu(game_items, menu_highlight_style=("bg_cyan", "fg_black")).show()
-                    selected = game_options[sidx] if isinstance(sidx, int) else None
+                if outcome is not journal.Outcome.DROPPED:
+                    print(f"{colr('Play not sent yet', Role.ERROR)}; it's queued and will be sent on the next run")
+                exit(1)
+
+            selections.record(title, selected)
+        except Exception as e:
+            print(e)
+            print(f"{colr('Play adding failed', Role.ERROR)}!")
+
+def play_summary(args: dict):
+    import daemon
+    from playtable import PlayTable
+
+    api = daemon.backend()
+
+    summary = args.get('summary')
+    days = 0
+    filter_on = "".join(summary[1:]) if len(summary) > 1 else ""
+    if len(summary) > 0 and summary[0] != '.':
+        try:
+            days = int(summary[0])
+        except ValueError:
+            print("Summary must have a number or . as its first argument!")
+            exit(1) 
+
+    table = PlayTable.from_columns(api.get_play_columns(None if days < 1 else days))
+    if len(table):
+        summary_set = table.matching(filter_on).ranked(args.get('sortmode') or 'plays')
+    
+        if not summary_set: 
+            print(f"{colr('No games found', Role.ERROR)} matching filter condition: '{colr(filter_on, Role.COMMAND)}'!")
+        else: 
+            for game, plays in summary_set:
+                print(f"- {colr(game, Role.GAME)}: {colr(plays, Role.PLAY)}")
+    else:
+        print(f"{colr('No plays logged', Role.ERROR)}{' in that timespan' if days >= 1 else ''}!")
+
+def select_tagged(items: list, query: str) -> list:
+    import tags
+
+    try:
+        return tags.TagIndex(items).select(query)
+    except tags.TagQueryError as e:
+        print(colr(str(e), Role.ERROR))
+        exit(1)
+
+def manage_collection(args: dict, query: str):
+    import readline
+    import webbrowser
+
+    from simple_term_menu import TerminalMenu
+
+    import bulk, daemon, journal, prefetch
+
+    api = daemon.backend()
+
+    journal.replay()
+
+    user = api.get_user()
+    diff = api.sync_collection(user)
+    if diff:
+        print(f"Synced {colr(user, Role.USER)} collection: {diff}")
 
+    _owned, _ = api.get_collection(user, sync=False)
+    owned = select_tagged(_owned, query)
+    
+    if not owned: 
+        print(f"No items in the collection match the tag query: '{colr(query, Role.COMMAND)}'")
+        return
+
+    prefetcher = prefetch.Prefetcher(api, (o.game.id for o in owned))
+    labels = {o.game.name: i for i, o in reversed(list(enumerate(owned)))}
+
+    selected = True
+    while selected is not None:
+        sidx = TerminalMenu(
+            (o.game.name for o in owned), 
+            menu_highlight_style=("bg_cyan", "fg_black"),
+            title=f"{user} – Collection",
+            status_bar=lambda label: prefetcher.status(labels.get(label, 0)),
+        ).show()
+
+        selected = owned[sidx] if isinstance(sidx, int) else None
+        if selected is not None:
+            metadata = prefetcher.get(selected.game.id)
+            ssidx = TerminalMenu(
+                V_CollectionUpdate, 
+                menu_highlight_style=("bg_cyan", "fg_black"),
+                title=[s for s in [describe_item(selected.game.name, metadata), (selected.comment or "")] if s],
+            ).show()
             
-            if selected is not None:
-                if s_wishlist:
-                    plays = 4 if default else min(plays, max(plays, 1), 5)
-                    
-                    user = link.get_user()
-                    print(f"Checking {magenta(user)} collection to avoid duplicates...")
+            subselected = L_CollectionUpdate[ssidx] if isinstance(ssidx, int) else None
+            if subselected is CollectionUpdate.MARK_LOANED:
+                response = input("Loaned to: ").strip()
+                if not response: continue
+
+                bulk.queue(bulk.plan([selected], f"loaned={response}"))
+                journal.replay()
+            elif subselected in tag_actions:
+                bulk.queue(bulk.plan([selected], tag_actions[subselected]))
+                journal.replay()
+            elif subselected is CollectionUpdate.OPEN_PAGE:
+                webbrowser.open(f"https://boardgamegeek.com/boardgame/{selected.game.id}")           
+            elif subselected is not None:
+                print(f"No action has been implemented for: {subselected}")
+
+    prefetcher.close()
+
+def bulk_tag(args: dict, query: str):
+    import threading
+
+    import bulk, daemon, journal, link
+
+    # Sent from this process, since calls through the daemon are serialized and the whole point here is concurrency
+    daemon.run_locally()
+
+    ids = {v.strip() for v in (args.get("ids") or [''])[0].split(",") if v.strip()}
+    if not query and not ids:
+        print(f"Pick the items to update with {colr('--filters', Role.COMMAND)} and/or {colr('--ids', Role.COMMAND)}!")
+        exit(1)
+
+    user = link.get_user()
+    owned, _ = link.get_collection(user)
+    selected = [o for o in select_tagged(owned, query) if not ids or str(o.id) in ids or str(o.game.id) in ids]
 
-                    _collection, _wishlist = link.get_collection("Nathansbud")
-                    filter_cond = lambda item: selected['idx'] == item.game.id
-                    r_collection, r_wishlist = list(filter(filter_cond, _collection)), list(filter(filter_cond, _wishlist))
+    try:
+        planned = bulk.plan(selected, args.get("bulk"))
+    except ValueError as e:
+        print(colr(str(e), Role.ERROR))
+        exit(1)
+
+    print(f"{colr(len(planned), Role.PLAY)} of {len(selected)} selected item(s) to update")
+    if planned:
+        for item, comment, _ in planned[:10]:
+            print(f"- {colr(item.game.name, Role.GAME)}: {comment or '(no tags)'}")
+        if len(planned) > 10:
+            print(f"  ...and {len(planned) - 10} more")
+
+        if input("Apply? [y/N] ").strip().lower() not in ("y", "yes"):
+            return
+        bulk.queue(planned)
+
+    total = journal.journal.pending()
+    if not total:
+        return
+
+    done, counts, lock = 0, {}, threading.Lock()
+    def progress(outcome):
+        nonlocal done
+        with lock:
+            done += 1
+            counts[outcome] = counts.get(outcome, 0) + 1
+            print(f"\rSending changes: {done}/{total}", end="", flush=True)
+
+    remaining = journal.drain(workers=link.concurrency, progress=progress)
+    print()
+
+    dropped = counts.get(journal.Outcome.DROPPED, 0)
+    print(f"{colr(counts.get(journal.Outcome.SENT, 0), Role.PLAY)} change(s) sent to BoardGameGeek")
+    if dropped:
+        print(f"{colr(dropped, Role.ERROR)} change(s) failed repeatedly and were dropped")
+    if remaining:
+        print(f"{colr(len(remaining), Role.ERROR)} change(s) still queued; run the same command again to retry them")
+
+def manage_wishlist(args: dict):
+    import readline
+    import webbrowser
+
+    from simple_term_menu import TerminalMenu
+
+    import daemon, journal, prefetch
+
+    api = daemon.backend()
+
+    journal.replay()
+
+    user = api.get_user()
+    _, _wishlist = api.get_collection(user)
+    wishlist = sorted(_wishlist, key=lambda item: item.wishlist.priority)
+    prefetcher = prefetch.Prefetcher(api, (w.game.id for w in wishlist))
                     
-                    if r_wishlist:
-                        relevant = r_wishlist[0]
-                        print(f"Found {colr(relevant.game.name, Role.GAME)} on wishlist @ {bold(relevant.wishlist.priority)}, with comment: '{bold(relevant.wishlist.comment or '')}'.\n")
-                        if "y" == input(f"Update metadata ({bold('y/n')})? "):
-                            # This should probably use the /collectionitems/{cid} endpoint, but that requires
-                            # much more work than just hitting update_status, update_comment
-                            
-                            # only update comment if one exists; usually, this is a matter of updating wishlist 
-                            # position, so updating comment with "" is not desired behavior...the old comment
-                            if args.get("comment") is not None:    
-                                link.update_comment(relevant.id, relevant.game.id, args.get("comment"), wishlist=True)
-                            
-                            if relevant.wishlist.priority != plays:
-                                link.update_status(relevant.id, relevant.game.id, False, wishlist_priority=plays)
-                    elif r_collection:
-                        print("Item already exists in collection; ignoring...")
-                        exit(0)
-                    else:
-                        link.wishlist_game(
-                            selected['idx'], 
-                            selected['name'], 
-                            priority=plays,
-                            comment=args.get('comment')
-                        )
-                else:
-                    print(f"Adding {colr(plays, Role.PLAY)} {'plays' if plays > 1 else 'play'} to {colr(selected['name'], Role.GAME)} ({selected['year']})...")
-                    try:
-                        res = link.log_play(selected['idx'], plays=plays, comment=args.get('comment'))
-                        if res == 200:
-                            print(f"{colr('Plays added', Role.SUCCESS)}!" if plays > 1 else 'Play added!')
-                        else:
-                            if res == 401:
-                                print(f"{colr('Incorrect credentials', Role.ERROR)} for currently logged in account'. Try logging in with {colr('bgg -l', Role.COMMAND)}!")
-                            else:
-                                print(f"{colr('Play add failed', Role.ERROR)} for unknown reasons!")
-                            
-                            exit(1)
-
-                        if not title in cache or cache[title]['idx'] != selected['idx']:
-                            cache[title] = {'count': 1, 'idx': selected['idx'], 'name': selected['name'], 'year': selected['year']}
-                        else:
-                            cache[title]['count'] += 1
-
-                        with open(cache_path, 'w+') as cf:
-                            json.dump(cache, cf)
-                    except Exception as e:
-                        print(e)
-                        print(f"{colr('Play adding failed', Role.ERROR)}!")
-        
-        elif summary is not None:
-            days = 0
-            filter_on = "".join(summary[1:]) if len(summary) > 1 else ""
-            if len(summary) > 0 and summary[0] != '.':
-                try:
-                    days = int(summary[0])
-                except ValueError:
-                    print("Summary must have a number or . as its first argument!")
-                    exit(1) 
-
-            play_data = link.get_plays(None if days < 1 else days)
-            if play_data:
-                game_data = {}
-                for play in play_data:
-                    if play['name'] in game_data: game_data[play['name']] += play['plays']
-                    else: game_data[play['name']] = play['plays']
-
-                game_sorter = lambda gd: gd
-                if args.get('sortmode') == 'plays':
-                    game_sorter = lambda gd: (Reversor(gd[1]), gd[0] if not gd[0].lower().startswith("the ") else gd[0][4:])
-                elif args.get('sortmode') == 'title': 
-                    game_sorter = lambda gd: (gd[0] if not gd[0].lower().startswith("the ") else gd[0][4:])
-
-                summary_set = [gd for gd in sorted(game_data.items(), key=game_sorter) if filter_on.lower() in gd[0].lower()]
-            
-                if not summary_set: 
-                    print(f"{colr('No games found', Role.ERROR)} matching filter condition: '{colr(filter_on, Role.COMMAND)}'!")
-                else: 
-                    for game, plays in summary_set:
-                        print(f"- {colr(game, Role.GAME)}: {colr(plays, Role.PLAY)}")
-            else:
-                print(f"{colr('No plays logged', Role.ERROR)}{' in that timespan' if summary < 1 else ''}!")
-        elif args.get("collection") and not args.get("open"):
-            user = link.get_user()
-            _owned, _ = link.get_collection(user)
-            owned = [
-                o for o in _owned if len(filters) == 0 or
-                (o.comment and all(f in o.comment for f in filters))
-            ]
-            
-            if not owned: 
-                print(f"No items in the collection satisfies all applied filters: {filters}")
-            else:
-                selected = True
-                while selected is not None:
-                    sidx = TerminalMenu(
-                        (o.game.name for o in owned), 
+    selected = True
+    while selected is not None:
+        # Priorities, order and membership can all change between loops
+        prefetcher.show(w.game.id for w in wishlist)
+        entries = [f"{w.wishlist.priority} - {w.game.name}" for w in wishlist]
+        labels = {entry: i for i, entry in reversed(list(enumerate(entries)))}
+
+        sidx = TerminalMenu(
+            entries,
+            menu_highlight_style=("bg_cyan", "fg_black"),
+            title=f"{user} – Wishlist",
+            status_bar=lambda label: prefetcher.status(labels.get(label, 0)),
+        ).show()
+
+        selected = wishlist[sidx] if isinstance(sidx, int) else None
+        if selected is not None:
+            metadata = prefetcher.get(selected.game.id)
+
+            subselected = True
+            while subselected is True:
+                ssidx = TerminalMenu(
+                    V_WishlistUpdate,
+                    menu_highlight_style=("bg_cyan", "fg_black"),
+                    title=[s for s in [describe_item(selected.game.name, metadata), (selected.wishlist.comment or "")] if s],
+                ).show()
+                
+                subselected = L_WishlistUpdate[ssidx] if isinstance(ssidx, int) else None
+                if subselected is WishlistUpdate.CHANGE_PRIORITY:
+                    priority = TerminalMenu(
+                        ["1 (Need)", "2 (Want)", "3 (Could)", "4 (Exists)", "5 (Don't)"],
                         menu_highlight_style=("bg_cyan", "fg_black"),
-                        title=f"{user} – Collection"
+                        title=f"Update Priority - Currently: {selected.wishlist.priority}"
                     ).show()
+                    
+                    if priority is not None and (priority + 1 != selected.wishlist.priority):
+                        selected.wishlist.priority = priority + 1
+                        journal.submit(
+                            "update_status",
+                            selected.id,
+                            selected.game.id,
+                            owned=False,
+                            wishlist_priority=priority + 1
+                        )
 
-                    selected = owned[sidx] if isinstance(sidx, int) else None
-                    if selected is not None:
-                        metadata = link.get_game(selected.game.id)
-                        ssidx = TerminalMenu(
-                            V_CollectionUpdate, 
-                            menu_highlight_style=("bg_cyan", "fg_black"),
-                            title=[s for s in [f"{selected.game.name} - {metadata.format_metadata()}", (selected.comment or "")] if s],
-                        ).show()
+                        # re-sort after updating, first on name then on priority
+                        wishlist = sorted(
+                            sorted(wishlist, key=lambda n: n.game.name),
+                            key=lambda w: w.wishlist.priority
+                        )
                         
-                        subselected = L_CollectionUpdate[ssidx] if isinstance(ssidx, int) else None
-                        if subselected is CollectionUpdate.MARK_LOANED:
-                            response = input("Loaned to: ").strip()
-                            if not response: continue
-
-                            output = tags.modify_tags(
-                                selected,
-                                {tags.TagType.LOANED: response}
-                            )
-
-                            selected.comment = output
-                            link.update_comment(selected.id, selected.game.id, output)
-                        elif subselected is CollectionUpdate.MARK_RETURNED:
-                            output = tags.modify_tags(
-                                selected,
-                                {tags.TagType.LOANED: False} 
-                            )
-
-                            selected.comment = output
-                            link.update_comment(selected.id, selected.game.id, output)
-                        elif subselected in [
-                            CollectionUpdate.MARK_AUDIT,
-                            CollectionUpdate.MARK_GIVEAWAY,
-                            CollectionUpdate.MARK_KEEP
-                        ]:
-                            audit_value = "Giveaway" if subselected == CollectionUpdate.MARK_GIVEAWAY else (
-                                subselected == CollectionUpdate.MARK_AUDIT
-                            )
-
-                            output = tags.modify_tags(
-                                selected, 
-                                {tags.TagType.AUDIT: audit_value}
-                            )
-                            
-                            selected.comment = output
-                            link.update_comment(selected.id, selected.game.id, output)
-                            link.update_status(
-                                selected.id, 
-                                selected.game.id, 
-                                owned=True,
-                                trade=(subselected == CollectionUpdate.MARK_GIVEAWAY)
-                            )
-                                                        
-                        elif subselected is CollectionUpdate.MARK_GIVEAWAY:
-                            output = tags.modify_tags(
-                                selected, 
-                                {tags.TagType.AUDIT: "Giveaway"}
-                            )
-                            
-                            selected.comment = output
-                            link.update_comment(selected.id, selected.game.id, output)
-                        elif subselected is CollectionUpdate.CLEAR_TAGS:
-                            selected.comment = ""
-                            link.update_comment(
-                                selected.id, selected.game.id,
-                                {k: False for k in tags.parse_tags(selected.comment)}
-                            )
-                        elif subselected is CollectionUpdate.OPEN_PAGE:
-                            webbrowser.open(f"https://boardgamegeek.com/boardgame/{selected.game.id}")           
-                        elif subselected is not None:
-                            print(f"No action has been implemented for: {subselected}")
-        elif args.get("wishlist") and not args.get("open"):
-            user = link.get_user()
-            _, _wishlist = link.get_collection(user)
-            wishlist = sorted(_wishlist, key=lambda item: item.wishlist.priority)
-                            
-            selected = True
-            while selected is not None:
-                sidx = TerminalMenu(
-                    (f"{w.wishlist.priority} - {w.game.name}" for w in wishlist),
-                    menu_highlight_style=("bg_cyan", "fg_black"),
-                    title=f"{user} – Wishlist"
-                ).show()
+                elif subselected is WishlistUpdate.MARK_OWNED:
+                    journal.submit(
+                        "update_status",
+                        selected.id,
+                        selected.game.id,
+                        owned=True
+                    )
+                    
+                    # Owned games live in the collection menu, not here
+                    selected.owned = True
+                    wishlist.remove(selected)
+                elif subselected is WishlistUpdate.UPDATE_COMMENT:
+                    new_comment = input("Wishlist Comment: ").strip()
+                    selected.wishlist.comment = new_comment
+                    journal.submit("update_comment", selected.id, selected.game.id, new_comment, wishlist=True)
+                elif subselected is WishlistUpdate.DELETE_ITEM:
+                    journal.submit("delete_item", selected.id)
+                    wishlist.remove(selected)
+                elif subselected is WishlistUpdate.OPEN_PAGE:
+                    webbrowser.open(f"https://boardgamegeek.com/boardgame/{selected.game.id}")
+
+    prefetcher.close()
+
+def lookup_collection(args: dict, query: str):
+    import daemon, owners
+
+    api = daemon.backend()
+
+    users = list(dict.fromkeys(args.get('lookup')))
+    me = api.get_user() if args.get('wanted') else None
+    collections = api.get_collections(users + ([me] if me and me not in users else []))
+
+    # Tag queries are about each owner's own comments, so they're applied per collection
+    index = owners.OwnershipIndex({user: (select_tagged(owned, query), wishlist) for user, (owned, wishlist) in collections.items()})
+    if args.get('owned') == 'all':
+        gids = index.owned_by_all(users)
+    elif args.get('owned') == 'one':
+        gids = index.owned_by_exactly(1, users)
+    else:
+        gids = index.owned_by_any(users)
+
+    if me:
+        gids &= index.wanted_by(me)
+
+    for game in index.sorted(gids):
+        if len(users) == 1:
+            print(f"- {game.name}")
+        else:
+            print(f"- {game.name} [{', '.join(colr(u, Role.USER) for u in users if u in index.owners[int(game.id)])}]")
+
+def export_data(args: dict):
+    import export, httpcache, link
+
+    # Rows are written as they're parsed, which a daemon round trip would undo, so this always runs in-process
+    what, path = args.get('export')
+    user = link.get_user()
+    if what == 'plays':
+        rows, columns = export.play_rows(link.iter_plays(user)), export.play_columns
+    elif what == 'collection':
+        # Skips the response cache so the export is parsed as it streams in; offline, the cached copy is all there is
+        rows, columns = export.collection_rows(link.iter_collection(user, cache=httpcache.offline)), export.collection_columns
+    else:
+        print(f"Can only export {colr('plays', Role.COMMAND)} or {colr('collection', Role.COMMAND)}, not '{what}'!")
+        exit(1)
 
-                selected = wishlist[sidx] if isinstance(sidx, int) else None
-                if selected is not None:
-                    metadata = link.get_game(selected.game.id)
-
-                    subselected = True
-                    while subselected is True:
-                        ssidx = TerminalMenu(
-                            V_WishlistUpdate,
-                            menu_highlight_style=("bg_cyan", "fg_black"),
-                            title=[s for s in [f"{selected.game.name} - {metadata.format_metadata()}", (selected.wishlist.comment or "")] if s],
-                        ).show()
-                        
-                        subselected = L_WishlistUpdate[ssidx] if isinstance(ssidx, int) else None
-                        if subselected is WishlistUpdate.CHANGE_PRIORITY:
-                            priority = TerminalMenu(
-                                ["1 (Need)", "2 (Want)", "3 (Could)", "4 (Exists)", "5 (Don't)"],
-                                menu_highlight_style=("bg_cyan", "fg_black"),
-                                title=f"Update Priority - Currently: {selected.wishlist.priority}"
-                            ).show()
-                            
-                            if priority is not None and (priority + 1 != selected.wishlist.priority):
-                                selected.wishlist.priority = priority + 1
-                                link.update_status(
-                                    selected.id,
-                                    selected.game.id,
-                                    owned=False,
-                                    wishlist_priority=priority + 1
-                                )
-
-                                # re-sort after updating, first on name then on priority
-                                wishlist = sorted(
-                                    sorted(wishlist, key=lambda n: n.game.name),
-                                    key=lambda w: w.wishlist.priority
-                                )
-                                
-                        elif subselected is WishlistUpdate.MARK_OWNED:
-                            link.update_status(
-                                selected.id,
-                                selected.game.id,
-                                owned=True
-                            )
-                            
-                            owned.append(selected)
-                            owned = sorted(owned, key=lambda o: o.game.name)
-                        elif subselected is WishlistUpdate.UPDATE_COMMENT:
-                            new_comment = input("Wishlist Comment: ").strip()
-                            selected.wishlist.comment = new_comment
-                            link.update_comment(selected.id, selected.game.id, new_comment, wishlist=True)
-                        elif subselected is WishlistUpdate.DELETE_ITEM:
-                            link.delete_item(selected.id)
-                            wishlist.remove(selected)
-                        elif subselected is WishlistUpdate.OPEN_PAGE:
-                            webbrowser.open(f"https://boardgamegeek.com/boardgame/{selected.game.id}")
-    
-        elif lookup is not None:
-            _owned, _ = link.get_collection(lookup[0])
-            owned = [
-                o for o in _owned if len(filters) == 0 or
-                (o.comment and all(f in o.comment for f in filters))
-            ]
-
-            for o in owned:
-                print(f"- {o.game.name}")
-
-        elif args.get('open'):
-            user = link.get_user()
-            if args.get("wishlist"):
-                webbrowser.open(f'https://boardgamegeek.com/wishlist/{user}')               
+    try:
+        count = export.export(rows, columns, path, args.get('format'))
+    except export.ExportError as e:
+        print(colr(str(e), Role.ERROR))
+        exit(1)
+
+    if path != '-':
+        print(f"Exported {colr(count, Role.PLAY)} {what} rows for {colr(user, Role.USER)} to {path}")
+
+def open_account(args: dict):
+    import webbrowser
+
+    from credentials import get_user
+
+    user = get_user()
+    if args.get("wishlist"):
+        webbrowser.open(f'https://boardgamegeek.com/wishlist/{user}')               
+    else:
+        webbrowser.open(f'https://boardgamegeek.com/collection/user/{user}')               
+
+def main():
+    if sys.argv[1:2] == ["serve"]:
+        import daemon
+        return daemon.serve()
+
+    parser = build_parser()
+    args = vars(parser.parse_args())
+
+    if args.get('offline'):
+        import daemon, httpcache, transport
+        # The daemon would go online on our behalf, so everything is answered in this process
+        httpcache.offline = True
+        daemon.run_locally()
+
+        try:
+            return traced(args, parser)
+        except transport.OfflineError as e:
+            print(f"{colr('Not available offline', Role.ERROR)}: {e}")
+            exit(1)
+
+    return traced(args, parser)
+
+def traced(args: dict, parser: argparse.ArgumentParser):
+    if not (args.get('profile') or args.get('trace')):
+        return run(args, parser)
+
+    import daemon, tracing
+    # The daemon would do the interesting work out of sight, so profile everything in this process instead
+    daemon.run_locally()
+
+    listeners = []
+    if args.get('profile'):
+        listeners.append(tracing.Profile())
+    if args.get('trace'):
+        listeners.append(tracing.JsonLines(args['trace']))
+
+    for listener in listeners:
+        tracing.subscribe(listener)
+    try:
+        run(args, parser)
+    finally:
+        for listener in listeners:
+            tracing.unsubscribe(listener)
+            if isinstance(listener, tracing.Profile):
+                print(listener.report(" ".join(["bgg"] + sys.argv[1:])))
             else:
-                webbrowser.open(f'https://boardgamegeek.com/collection/user/{user}')               
-        elif no_args:
-            parser.print_help()
+                listener.close()
+
+def run(args: dict, parser: argparse.ArgumentParser):
+    query = (args.get("filters") or [''])[0]
+    
+    no_args = True
+    if args.get('reset_cache'): 
+        no_args = False
+        reset_cache()
+
+    if args.get('login'):
+        login()
+    elif args.get('add') is not None:
+        add_play(args, parser)
+    elif args.get('summary') is not None:
+        play_summary(args)
+    elif args.get("collection") and args.get("bulk"):
+        bulk_tag(args, query)
+    elif args.get("collection") and not args.get("open"):
+        manage_collection(args, query)
+    elif args.get("wishlist") and not args.get("open"):
+        manage_wishlist(args)
+    elif args.get('lookup') is not None:
+        lookup_collection(args, query)
+    elif args.get('export') is not None:
+        export_data(args)
+    elif args.get('open'):
+        open_account(args)
+    elif no_args:
+        parser.print_help()
+
+if __name__ == '__main__':
+    try:
+        main()
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,57 @@
+# Bulk tag edits for `bgg -c --bulk`. An action (e.g. audit, or loaned=Alice) is planned against every selected
+# collection item up-front, queued in the journal, and then sent by a pool of journal workers sharing the transport's
+# rate limit. Items that already carry the edit are skipped, so re-running an interrupted bulk edit only queues what's
+# left; anything still queued from before is sent along with it.
+
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import tags
+
+from model import CollectionItem
+from tags import TagType
+
+actions = ("audit", "giveaway", "keep", "returned", "clear", "loaned=<name>")
+
+def parse_action(action: str) -> Tuple[str, str]:
+    name, _, value = action.partition("=")
+    name, value = name.strip().lower(), value.strip()
+    if name not in ("audit", "giveaway", "keep", "returned", "clear", "loaned") or (name == "loaned") != bool(value):
+        raise ValueError(f"Unknown bulk action {action!r}; expected one of: {', '.join(actions)}")
+
+    return name, value
+
+def tag_edit(item: CollectionItem, action: str) -> Tuple[Dict[Union[TagType, str], Union[bool, str]], Optional[dict]]:
+    """The tag changes for an action, plus the update_status arguments it implies (if any)"""
+    name, value = parse_action(action)
+
+    if name == "loaned":
+        return {TagType.LOANED: value}, None
+    elif name == "returned":
+        return {TagType.LOANED: False}, None
+    elif name in ("audit", "giveaway", "keep"):
+        audit = "Giveaway" if name == "giveaway" else name == "audit"
+        return {TagType.AUDIT: audit}, {"owned": True, "trade": name == "giveaway"}
+    else:
+        return {tag: False for tag in tags.parse_tags(item.comment)}, None
+
+def plan(items: Iterable[CollectionItem], action: str) -> List[Tuple[CollectionItem, str, Optional[dict]]]:
+    """(item, new comment, status changes) for every item the action would actually change"""
+    parse_action(action)
+
+    planned = []
+    for item in items:
+        edit, status = tag_edit(item, action)
+        comment = tags.modify_tags(item, edit)
+        if comment != tags.modify_tags(item, {}):
+            planned.append((item, comment, status))
+
+    return planned
+
+def queue(planned: List[Tuple[CollectionItem, str, Optional[dict]]]):
+    import journal
+
+    for item, comment, status in planned:
+        item.comment = comment
+        journal.enqueue("update_comment", item.id, item.game.id, comment)
+        if status is not None:
+            journal.enqueue("update_status", item.id, item.game.id, **status)
@@ -0,0 +1,30 @@
+# Reading and saving BoardGameGeek credentials. Kept apart from link so that commands which only need the username
+# (e.g. `bgg -o`) don't import the whole network stack.
+
+import json
+import os
+
+from getpass import getpass
+
+from utils import *
+
+def get_user():
+    try: 
+        with open(creds_path) as jf: 
+            return json.load(jf).get("username")
+    except FileNotFoundError:
+        return login().get("username")
+
+def login():
+    import session
+
+    os.makedirs(os.path.join(os.path.dirname(__file__), "credentials"), exist_ok=True)
+    username = input(f"Enter your BoardGameGeek {colr('username', Role.USER)}: ")
+    password = getpass(f"Enter your BoardGameGeek {bold('password')}: ")
+    # The old cookie jar goes first, so a running `bgg serve` that sees the new credentials can't reload it
+    session.manager.invalidate()
+    with open(creds_path, 'w') as cf:
+        creds = {"username": username, "password": password}
+        json.dump(creds, cf)
+        print(f"Saved login information for user {colr(username, Role.USER)}; if this is {red('incorrect')}, run {colr('bgg -l', Role.COMMAND)} to login again!")
+        return creds     
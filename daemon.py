@@ -0,0 +1,147 @@
+# `bgg serve`: an optional long-running process that keeps everything a command needs warm (imports, the logged in
+# session, SQLite connections, parsed game metadata) and answers requests over a local Unix socket. CLI commands get
+# their API through backend(), which talks to the daemon when one is running and falls back to calling link
+# in-process when it isn't.
+#
+# The protocol is one JSON object per line in each direction: {"method", "args", "kwargs"} in, and either
+# {"result"} or {"error", "type"} out. Models are encoded with model.encode/decode.
+
+import json
+import os
+import socket
+import socketserver
+import threading
+
+from utils import *
+
+# Only these link functions can be called through the daemon
+methods = {
+    "get_user", "get_games", "get_game", "get_games_by_id", "get_plays", "get_play_columns", "sync_plays",
+    "get_collection", "get_collections", "sync_collection",
+    "log_play", "wishlist_game", "update_status", "update_comment", "delete_item",
+}
+
+class RemoteError(Exception):
+    pass
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        import link
+        from model import decode, encode
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request["method"] not in methods:
+                    raise RemoteError(f"Unknown method: {request['method']}")
+
+                result = getattr(link, request["method"])(*decode(request.get("args", [])), **request.get("kwargs", {}))
+                response = {"result": encode(result)}
+            except (Exception, SystemExit) as e:
+                response = {"error": str(e), "type": type(e).__name__}
+
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def running(path: str = socket_path) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(path)
+        return True
+    except OSError:
+        return False
+
+def serve(path: str = socket_path):
+    if running(path):
+        print(f"A bgg daemon is {colr('already running', Role.ERROR)} at {path}")
+        exit(1)
+    elif os.path.exists(path):
+        # Left behind by a daemon that didn't shut down cleanly
+        os.remove(path)
+
+    # Pay for the imports and the login up front, rather than on the first request
+    import link
+    import session
+    try:
+        session.manager.session
+    except (OSError, session.AuthenticationError) as e:
+        print(f"{colr('Could not log in', Role.ERROR)} ({e}); mutations will log in on first use")
+
+    server = Server(path, Handler)
+    os.chmod(path, 0o600)
+    print(f"Serving {colr(link.get_user(), Role.USER)} on {path}; stop with {colr('Ctrl-C', Role.COMMAND)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+class Remote:
+    """Stand-in for the link module that forwards calls to the daemon"""
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        self.stream = connection.makefile("rwb")
+        self._lock = threading.Lock()
+
+    def call(self, method: str, *args, **kwargs):
+        from model import decode, encode
+
+        with self._lock:
+            self.stream.write(json.dumps({"method": method, "args": encode(list(args)), "kwargs": kwargs}).encode() + b"\n")
+            self.stream.flush()
+            line = self.stream.readline()
+
+        if not line:
+            raise RemoteError("The bgg daemon closed the connection")
+
+        response = json.loads(line)
+        if "error" in response:
+            raise remote_exception(response["type"], response["error"])
+
+        return decode(response["result"])
+
+    def __getattr__(self, method: str):
+        if method not in methods:
+            raise AttributeError(method)
+
+        return lambda *args, **kwargs: self.call(method, *args, **kwargs)
+
+def remote_exception(kind: str, message: str) -> Exception:
+    # Keep the exception types callers already handle (e.g. the journal treating transport errors as "offline")
+    if kind in ("TransportError", "CircuitOpenError"):
+        import transport
+        return transport.TransportError(message)
+    elif kind == "AuthenticationError":
+        import session
+        return session.AuthenticationError(message)
+    elif kind == "SystemExit":
+        return SystemExit(message)
+
+    return RemoteError(f"{kind}: {message}")
+
+_backend = None
+
+def run_locally():
+    """Ignores any running daemon from here on, so that everything happens in this process"""
+    global _backend
+    import link
+    _backend = link
+
+def backend(path: str = socket_path):
+    """The daemon if one is listening, otherwise the in-process link module"""
+    global _backend
+    if _backend is None:
+        try:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(path)
+            _backend = Remote(connection)
+        except OSError:
+            import link
+            _backend = link
+
+    return _backend
@@ -0,0 +1,131 @@
+# Streaming export of play history and collections for `bgg --export`. Rows are written as each page (or, for the
+# collection, each streamed item) is parsed, so memory use stays flat however long the history is. CSV and JSON Lines
+# need nothing extra; Parquet needs pyarrow, and is written in row groups of `batch_size` rows.
+
+import csv
+import json
+import os
+import sys
+
+from typing import IO, Iterable, Iterator, Optional
+
+import tags
+
+from model import CollectionItem
+
+formats = ("csv", "jsonl", "parquet")
+
+play_columns = ("id", "date", "quantity", "game_id", "name", "comments", "players")
+collection_columns = (
+    "collid", "game_id", "name", "owned", "wishlist", "wishlist_priority", "wishlist_comment", "comment", "tags", "modified"
+)
+
+class ExportError(Exception):
+    pass
+
+def play_rows(plays: Iterable[dict]) -> Iterator[dict]:
+    for play in plays:
+        yield {
+            "id": play["id"],
+            "date": play["date"],
+            "quantity": play["plays"],
+            "game_id": play["game_id"],
+            "name": play["name"],
+            "comments": play["comments"],
+            "players": play["players"],
+        }
+
+def collection_rows(items: Iterable[CollectionItem]) -> Iterator[dict]:
+    for item in items:
+        yield {
+            "collid": item.id,
+            "game_id": int(item.game.id),
+            "name": item.game.name,
+            "owned": bool(item.owned),
+            "wishlist": item.wishlist is not None,
+            "wishlist_priority": item.wishlist.priority if item.wishlist else None,
+            "wishlist_comment": item.wishlist.comment if item.wishlist else None,
+            "comment": item.comment,
+            "tags": {tags.tag_name(tag): value for tag, value in tags.parse_tags(item.comment).items()},
+            "modified": item.modified,
+        }
+
+def guess_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    return {"json": "jsonl", "ndjson": "jsonl", "pq": "parquet"}.get(extension, extension if extension in formats else "csv")
+
+def write_csv(rows: Iterable[dict], columns: tuple, out: IO[str]) -> int:
+    writer = csv.DictWriter(out, fieldnames=columns)
+    writer.writeheader()
+
+    count = 0
+    for row in rows:
+        # Lists (players) read best joined; tag dicts are kept as JSON so that flags and values survive
+        writer.writerow({
+            k: "; ".join(v) if isinstance(v, list) else json.dumps(v) if isinstance(v, dict) else v
+            for k, v in row.items()
+        })
+        count += 1
+    return count
+
+def write_jsonl(rows: Iterable[dict], columns: tuple, out: IO[str]) -> int:
+    count = 0
+    for row in rows:
+        out.write(json.dumps(row) + "\n")
+        count += 1
+    return count
+
+def write_parquet(rows: Iterable[dict], columns: tuple, path: str, batch_size: int = 10000) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    types = {
+        "id": pa.int64(), "collid": pa.int64(), "game_id": pa.int64(), "quantity": pa.int32(),
+        "wishlist_priority": pa.int32(), "owned": pa.bool_(), "wishlist": pa.bool_(), "players": pa.list_(pa.string()),
+    }
+    schema = pa.schema([(column, types.get(column, pa.string())) for column in columns])
+
+    count, batch = 0, []
+    with pq.ParquetWriter(path, schema) as writer:
+        def flush():
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            batch.clear()
+
+        for row in rows:
+            batch.append({k: json.dumps(v) if isinstance(v, dict) else v for k, v in row.items()})
+            count += 1
+            if len(batch) >= batch_size:
+                flush()
+        if batch or not count:
+            flush()
+
+    return count
+
+def export(rows: Iterable[dict], columns: tuple, path: str, format: Optional[str] = None) -> int:
+    """Writes rows to path ("-" for stdout) as they arrive, returning how many were written"""
+    format = format or guess_format(path)
+    if format not in formats:
+        raise ExportError(f"Unknown export format {format!r}; expected one of: {', '.join(formats)}")
+
+    if format == "parquet":
+        if path == "-":
+            raise ExportError("Parquet can't be written to stdout")
+        return write_parquet(rows, columns, path)
+
+    write = write_csv if format == "csv" else write_jsonl
+    if path == "-":
+        try:
+            count = write(rows, columns, sys.stdout)
+            sys.stdout.flush()
+            return count
+        except BrokenPipeError:
+            # The reader stopped early (e.g. `| head`). Point stdout at devnull so the interpreter's own flush on the
+            # way out doesn't fail again, and stop without a traceback
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+
+    with open(path, "w", newline="" if format == "csv" else None) as out:
+        return write(rows, columns, out)
@@ -0,0 +1,168 @@
+# On-disk cache of BGG's XML API responses, consulted by transport for every GET. Entries are keyed by normalized URL
+# and live for a per-endpoint TTL; after that they're revalidated with If-None-Match / If-Modified-Since when BGG sent
+# an ETag or Last-Modified, and metadata endpoints are served stale while a background refresh runs. The cache is
+# bounded in size and evicts the least recently used responses first. In offline mode every cached response is
+# served regardless of age and nothing else is sent.
+
+import io
+import json
+import os
+import time
+
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+
+from requests.structures import CaseInsensitiveDict
+
+from store import connection
+from utils import http_cache_path
+
+# Seconds a response is fresh for, by the last segment of its path; endpoints not listed aren't cached. Plays and
+# collections change whenever a play is logged or an item is edited, so they only get a short window (and mutations
+# drop them, see ResponseCache.mutated)
+ttls = {
+    "search": 24 * 60 * 60,
+    "thing": 7 * 24 * 60 * 60,
+    "plays": 5 * 60,
+    "collection": 5 * 60,
+}
+
+# How much longer past its TTL a response may still be served while it's refreshed in the background
+stale_ttls = {
+    "search": 7 * 24 * 60 * 60,
+    "thing": 30 * 24 * 60 * 60,
+}
+
+mutable = ("plays", "collection")
+
+# BGG reports some errors (throttling on /thing, unknown users on /plays) in a 200 response
+_error_markers = (b"<error", b"messagebox error")
+
+offline = bool(os.environ.get("BGG_OFFLINE"))
+
+def endpoint(url: str) -> str:
+    return urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1]
+
+def normalize(url: str) -> str:
+    """The same request however it's spelled: lowercase scheme and host, sorted query, no empty parameters"""
+    parts = urlsplit(url)
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query) if v))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+
+class ResponseCache:
+    def __init__(self, path: str = http_cache_path, max_bytes: Optional[int] = None):
+        self.path = path
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.environ.get("BGG_HTTP_CACHE_MB", 64)) * 1024 * 1024
+
+        with self.db as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    headers TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at);
+            """)
+
+    @property
+    def db(self):
+        return connection(self.path)
+
+    def cacheable(self, url: str) -> bool:
+        return endpoint(url) in ttls
+
+    def lookup(self, url: str):
+        return self.db.execute("SELECT * FROM responses WHERE key = ?", (normalize(url),)).fetchone()
+
+    def fresh(self, entry) -> bool:
+        return time.time() - entry["stored_at"] <= ttls.get(entry["endpoint"], 0)
+
+    def usable_stale(self, entry) -> bool:
+        return time.time() - entry["stored_at"] <= ttls.get(entry["endpoint"], 0) + stale_ttls.get(entry["endpoint"], 0)
+
+    def conditional_headers(self, entry) -> dict:
+        headers = json.loads(entry["headers"])
+        conditional = {}
+        if headers.get("ETag"):
+            conditional["If-None-Match"] = headers["ETag"]
+        if headers.get("Last-Modified"):
+            conditional["If-Modified-Since"] = headers["Last-Modified"]
+        return conditional
+
+    def response(self, entry, url: str) -> requests.Response:
+        """Rebuilds a cached response; streaming callers can still read it through .raw"""
+        with self.db as db:
+            db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), entry["key"]))
+
+        return self._build(url, json.loads(entry["headers"]), entry["body"])
+
+    def _build(self, url: str, headers: dict, body: bytes) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = body
+        response.raw = io.BytesIO(body)
+        return response
+
+    def store(self, url: str, response: requests.Response) -> requests.Response:
+        """Caches a 200 response, returning one that can still be read (a streamed body is consumed here)"""
+        body = response.content
+        if any(marker in body[:512] for marker in _error_markers):
+            return response
+        # The body has already been decompressed, so the transfer headers no longer describe it
+        headers = {
+            k: v for k, v in response.headers.items()
+            if k.lower() not in ("content-encoding", "content-length", "transfer-encoding", "set-cookie")
+        }
+        now = time.time()
+        with self.db as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, headers, body, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (normalize(url), endpoint(url), json.dumps(headers), body, len(body), now, now)
+            )
+        self.evict()
+
+        return self._build(url, headers, body)
+
+    def refresh(self, entry):
+        """Marks a response fresh again after the server answered 304 Not Modified"""
+        with self.db as db:
+            db.execute("UPDATE responses SET stored_at = ? WHERE key = ?", (time.time(), entry["key"]))
+
+    def evict(self):
+        with self.db as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            for row in db.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+                db.execute("DELETE FROM responses WHERE key = ?", (row["key"],))
+                total -= row["size"]
+                if total <= self.max_bytes:
+                    break
+
+    def mutated(self):
+        """Drops responses a mutation may have made out of date"""
+        with self.db as db:
+            db.executemany("DELETE FROM responses WHERE endpoint = ?", [(e,) for e in mutable])
+
+    def clear(self):
+        with self.db as db:
+            db.execute("DELETE FROM responses")
+
+cache = None
+
+def get_cache() -> ResponseCache:
+    global cache
+    if cache is None:
+        cache = ResponseCache()
+
+    return cache
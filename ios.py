@@ -1,5 +1,6 @@
+from datetime import date
 from sys import platform
-import link
+import journal, link
 
 try:
     import dialogs
@@ -25,9 +26,16 @@ def choose_title():
             if game_options:
                 selected = dialogs.list_dialog("Choose Title", [f'{g["name"]} ({g["year"]}) - {g["idx"]}' for g in game_options])		
                 if selected: 
-                    idx = selected.split('-')[-1]
-                    link.log_play(idx, plays)			
-                    dialogs.alert("Add Success", f"Added {str(plays) + ' plays' if plays != 1 else str(plays) + ' play'} to {game}", "Close", hide_cancel_button=True)
+                    idx = selected.split('-')[-1].strip()
+                    entry = journal.submit("log_play", idx, plays, playdate=date.today().isoformat())
+                    outcome = journal.wait(entry)
+                    count = str(plays) + ' plays' if plays != 1 else str(plays) + ' play'
+                    if outcome is journal.Outcome.SENT:
+                        dialogs.alert("Add Success", f"Added {count} to {game}", "Close", hide_cancel_button=True)
+                    elif outcome is journal.Outcome.DROPPED:
+                        dialogs.alert("Add Failed", f"BoardGameGeek rejected {count} of {game}", "Close", hide_cancel_button=True)
+                    else:
+                        dialogs.alert("Play Queued", f"Could not send {count} of {game} yet; it will be sent on the next run", "Close", hide_cancel_button=True)
             else:
                 dialogs.alert(f"No entries found for {game} on BoardGameGeek!")
     except ValueError:
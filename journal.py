@@ -0,0 +1,337 @@
+# Write-behind journal for collection and play mutations. Every change is written to the local database first and
+# then sent to BGG from a background thread, so interactive menus don't wait on a POST, and a change made while BGG
+# is unreachable isn't lost: whatever is still queued is replayed on the next run.
+#
+# Redundant writes are coalesced before they're sent, e.g. three comment edits on the same collection item only
+# result in the last one being posted.
+
+import atexit
+import inspect
+import json
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Set
+
+import requests
+
+import daemon
+import httpcache
+import link
+import session
+import transport
+
+from store import connection
+from utils import *
+
+max_attempts = 3
+
+class Outcome(Enum):
+    SENT = "sent"
+    # Something went wrong with this entry in particular; it stays queued but other entries can still be sent
+    DEFERRED = "deferred"
+    # Failed too many times and was given up on
+    DROPPED = "dropped"
+    # Offline or logged out, so there's no point sending anything else
+    STOPPED = "stopped"
+
+def bind(kind: str, args: tuple, kwargs: dict) -> dict:
+    arguments = inspect.signature(getattr(link, kind)).bind(*args, **kwargs)
+    arguments.apply_defaults()
+    return arguments.arguments
+
+# Mutations sharing a key supersede each other; a delete supersedes everything else queued for that item. Keys are
+# always "<kind>:<item id>[:...]", so the item an entry is for can be read back off its key (see subject)
+def coalesce_keys(kind: str, arguments: dict) -> List[str]:
+    if kind == "update_comment":
+        return [f"comment:{arguments['cid']}:{bool(arguments['wishlist'])}"]
+    elif kind == "update_status":
+        return [f"status:{arguments['cid']}"]
+    elif kind == "delete_item":
+        cid = arguments['cid']
+        return [f"delete:{cid}", f"status:{cid}", f"comment:{cid}:True", f"comment:{cid}:False"]
+    elif kind == "wishlist_game":
+        return [f"wishlist:{arguments['gid']}"]
+
+    return []
+
+def subject(entry) -> Optional[str]:
+    return entry["key"].split(":")[1] if entry["key"] else None
+
+def mirror(kind: str, arguments: dict):
+    """Applies a queued mutation to the local collection snapshot right away, rather than once it's been sent"""
+    store = link.get_collection_store()
+    if kind == "update_comment":
+        store.set_comment(arguments['cid'], arguments['comment'], arguments['wishlist'])
+    elif kind == "update_status":
+        store.set_status(arguments['cid'], arguments['owned'], arguments['wishlist_priority'])
+    elif kind == "delete_item":
+        store.delete(arguments['cid'])
+
+class Journal:
+    kinds = {"log_play", "update_comment", "update_status", "delete_item", "wishlist_game"}
+
+    def __init__(self, path: str = db_path):
+        self.path = path
+        self._worker = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._idle = threading.Event()
+        self._idle.set()
+        # How each entry tried during this run went, so a caller can wait on the one it submitted
+        self._outcomes: Dict[int, Outcome] = {}
+
+        with self.db as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS journal (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    key TEXT,
+                    args TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS journal_key ON journal(key);
+            """)
+
+    @property
+    def db(self):
+        return connection(self.path)
+
+    def pending(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+    def submit(self, kind: str, *args, **kwargs) -> int:
+        entry = self.enqueue(kind, *args, **kwargs)
+        self.start()
+        return entry
+
+    def enqueue(self, kind: str, *args, **kwargs) -> int:
+        """Queues (and mirrors) a mutation without starting the background worker, e.g. ahead of a drain"""
+        if kind not in self.kinds:
+            raise ValueError(f"Unknown mutation: {kind}")
+
+        arguments = bind(kind, args, kwargs)
+        keys = coalesce_keys(kind, arguments)
+        with self.db as db:
+            db.executemany("DELETE FROM journal WHERE key = ?", [(k,) for k in keys])
+            entry = db.execute(
+                "INSERT INTO journal (kind, key, args, created) VALUES (?, ?, ?, ?)",
+                (kind, keys[0] if keys else None, json.dumps({"args": args, "kwargs": kwargs}), time.time())
+            ).lastrowid
+
+        mirror(kind, arguments)
+        return entry
+
+    def start(self):
+        if httpcache.offline:
+            return
+
+        with self._lock:
+            if self._worker is None:
+                self._idle.clear()
+                self._worker = threading.Thread(target=self._run, name="journal", daemon=True)
+                self._worker.start()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits for the background worker to go idle; True if nothing is left queued"""
+        self._idle.wait(timeout)
+        return self.pending() == 0
+
+    def wait(self, entry: int, timeout: Optional[float] = None) -> Optional[Outcome]:
+        """Waits for an entry returned by submit to be tried, returning how that went. None if the worker stopped
+        (or never started, e.g. offline) without getting to it, so it's still queued"""
+        with self._changed:
+            self._changed.wait_for(lambda: entry in self._outcomes or self._idle.is_set(), timeout)
+            return self._outcomes.get(entry)
+
+    def sent(self, entry: int) -> bool:
+        """Whether an entry returned by submit has gone through, rather than still being queued or given up on"""
+        return self._outcomes.get(entry) is Outcome.SENT
+
+    def drain(self, workers: int = 4, progress: Optional[Callable[[Outcome], None]] = None) -> Set[int]:
+        """Sends everything queued over several workers at once, returning the ids of entries left queued.
+
+        Entries for the same item are still sent one at a time and in order. The background worker is kept from
+        starting (or waited on, if it's already running) until the drain is done.
+        """
+        while True:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.current_thread()
+                    self._idle.clear()
+                    break
+            self._idle.wait()
+
+        claim_lock = threading.Lock()
+        claimed: Set[int] = set()
+        busy: Set[str] = set()
+        failed: Set[int] = set()
+        stopped = threading.Event()
+
+        def claim():
+            with claim_lock:
+                blocked = set(busy)
+                for entry in self.db.execute("SELECT * FROM journal ORDER BY id"):
+                    item = subject(entry)
+                    if entry["id"] in claimed or item in blocked:
+                        # An item's later entries wait behind any earlier one that's in flight or has failed
+                        if item is not None:
+                            blocked.add(item)
+                        continue
+
+                    claimed.add(entry["id"])
+                    if item is not None:
+                        busy.add(item)
+                    return entry
+
+        def work():
+            while not stopped.is_set() and (entry := claim()) is not None:
+                outcome = self._apply(entry)
+                with claim_lock:
+                    busy.discard(subject(entry))
+                    if outcome in (Outcome.SENT, Outcome.DROPPED):
+                        claimed.discard(entry["id"])
+                    else:
+                        failed.add(entry["id"])
+                        if subject(entry) is not None:
+                            # Keep the item blocked so its later entries aren't sent out of order
+                            busy.add(subject(entry))
+                if outcome is Outcome.STOPPED:
+                    stopped.set()
+                if progress:
+                    progress(outcome)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="journal") as pool:
+                for future in [pool.submit(work) for _ in range(max(1, workers))]:
+                    future.result()
+        finally:
+            with self._lock:
+                self._stop()
+
+        return {row["id"] for row in self.db.execute("SELECT id FROM journal")}
+
+    def _next(self, skipped: Set[int], blocked: Set[str]):
+        # Checked under the lock so that a submit racing with the worker winding down always gets a worker
+        with self._lock:
+            for entry in self.db.execute("SELECT * FROM journal ORDER BY id"):
+                if entry["id"] not in skipped and subject(entry) not in blocked:
+                    return entry
+
+            self._stop()
+
+    def _stop(self):
+        # Always called with the lock held
+        self._worker = None
+        self._idle.set()
+        self._changed.notify_all()
+
+    def _run(self):
+        # An entry that fails is left for the next run, and holds back only later entries for the same item (as in
+        # drain), rather than everything queued behind it
+        skipped: Set[int] = set()
+        blocked: Set[str] = set()
+        while (entry := self._next(skipped, blocked)) is not None:
+            outcome = self._apply(entry)
+            if outcome is Outcome.STOPPED:
+                with self._lock:
+                    self._stop()
+                return
+            elif outcome is Outcome.DEFERRED:
+                skipped.add(entry["id"])
+                if subject(entry) is not None:
+                    blocked.add(subject(entry))
+
+    def _apply(self, entry) -> Outcome:
+        outcome = self._send(entry)
+        with self._changed:
+            self._outcomes[entry["id"]] = outcome
+            self._changed.notify_all()
+
+        return outcome
+
+    def _send(self, entry) -> Outcome:
+        """Sends one entry, dropping it from the journal unless it should be retried later"""
+        payload = json.loads(entry["args"])
+        with self.db as db:
+            db.execute("UPDATE journal SET attempts = attempts + 1 WHERE id = ?", (entry["id"],))
+
+        try:
+            result = getattr(daemon.backend(), entry["kind"])(*payload["args"], **payload["kwargs"])
+        except requests.HTTPError as e:
+            # BGG answered but refused this particular change; the rest of the queue can still go through
+            if e.response is None or e.response.status_code != 401:
+                return self._failed(entry, e)
+            result = 401
+        except (transport.TransportError, OSError) as e:
+            # Most likely offline; leave everything queued for the next run
+            print(f"\n{colr('Could not reach BoardGameGeek', Role.ERROR)} ({e}); changes will be retried on the next run")
+            return Outcome.STOPPED
+        except session.AuthenticationError:
+            result = 401
+        except Exception as e:
+            # Anything else is a bug rather than a connectivity problem
+            return self._failed(entry, e)
+
+        if result == 401:
+            print(f"\n{colr('Incorrect credentials', Role.ERROR)} for currently logged in account. Try logging in with {colr('bgg -l', Role.COMMAND)}!")
+            return Outcome.STOPPED
+        elif entry["kind"] == "log_play" and result not in (200, None):
+            # BGG rejected the play itself, so sending it again won't help
+            print(f"\n{colr('Play add failed', Role.ERROR)} for unknown reasons!")
+            return self._drop(entry)
+
+        with self.db as db:
+            db.execute("DELETE FROM journal WHERE id = ?", (entry["id"],))
+
+        return Outcome.SENT
+
+    def _failed(self, entry, error: Exception) -> Outcome:
+        """Leaves a failed entry queued to be retried, unless it's failed too often to wedge the queue forever"""
+        failed = f"Failed to apply {entry['kind']}"
+        print(f"\n{colr(failed, Role.ERROR)}: {error}")
+        if entry["attempts"] + 1 < max_attempts:
+            return Outcome.DEFERRED
+
+        return self._drop(entry)
+
+    def _drop(self, entry) -> Outcome:
+        with self.db as db:
+            db.execute("DELETE FROM journal WHERE id = ?", (entry["id"],))
+
+        return Outcome.DROPPED
+
+journal = Journal()
+
+def submit(kind: str, *args, **kwargs) -> int:
+    return journal.submit(kind, *args, **kwargs)
+
+def enqueue(kind: str, *args, **kwargs) -> int:
+    return journal.enqueue(kind, *args, **kwargs)
+
+def flush(timeout: Optional[float] = None) -> bool:
+    return journal.flush(timeout)
+
+def wait(entry: int, timeout: Optional[float] = None) -> Optional[Outcome]:
+    return journal.wait(entry, timeout)
+
+def sent(entry: int) -> bool:
+    return journal.sent(entry)
+
+def drain(workers: int = 4, progress: Optional[Callable[[Outcome], None]] = None) -> Set[int]:
+    return journal.drain(workers, progress)
+
+def replay():
+    if journal.pending():
+        journal.start()
+
+@atexit.register
+def _drain():
+    if not journal._idle.is_set():
+        print(f"Sending {journal.pending()} queued change(s) to BoardGameGeek...")
+    
+    if not journal.flush(timeout=60):
+        print(f"{colr(journal.pending(), Role.PLAY)} change(s) queued; they will be sent on the next run")
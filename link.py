@@ -1,5 +1,8 @@
 import datetime
+import functools
+import io
 import json
+import math
 import os
 import re
 import time
@@ -7,135 +10,307 @@ import time
 import requests
 import xmltodict
 
-from typing import Optional, Union, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union, Dict, Iterable, Iterator, List, Tuple
 from urllib.parse import quote
-from getpass import getpass
+
+import httpcache
+import session
+import tracing
+import transport
+import xmlstream
 
 from utils import *
-from model import Game, CollectionItem, WishlistMetadata
+from credentials import get_user, login
+from model import Game, CollectionItem, CollectionDiff
+from store import GameStore, CollectionStore, PlayStore, TitleStore
+
 
+# Docs: https://boardgamegeek.com/wiki/page/BGG_XML_API2 (bgg_api and bgg_site live in utils)
+plays_page_size = 100
 
-# Docs: https://boardgamegeek.com/wiki/page/BGG_XML_API2
-bgg_api = "https://api.geekdo.com/xmlapi2"
+# Upper bound on simultaneous requests made by any one bulk operation
+concurrency = int(os.environ.get("BGG_CONCURRENCY", 4))
 
 def authenticated_request(method):
+    @functools.wraps(method)
     def authenticated_function(*args, **kwargs):
-        with requests.Session() as session, open(creds_path) as jf:
-            session.post('https://boardgamegeek.com/login/api/v1', data=json.dumps({
-                "credentials": json.load(jf)
-            }), headers={'content-type': 'application/json'})
-
-            return method(*args, BGG_SESSION=session, **kwargs)
+        return method(*args, BGG_SESSION=session.manager, **kwargs)
 
     return authenticated_function
 
-def get_user():
-    try: 
-        with open(creds_path) as jf: 
-            return json.load(jf).get("username")
-    except FileNotFoundError:
-        return login().get("username")
-
-def login():
-    os.makedirs(os.path.join(os.path.dirname(__file__), "credentials"), exist_ok=True)
-    username = input(f"Enter your BoardGameGeek {colr('username', Role.USER)}: ")
-    password = getpass(f"Enter your BoardGameGeek {bold('password')}: ")
-    with open(creds_path, 'w') as cf:
-        creds = {"username": username, "password": password}
-        json.dump(creds, cf)
-        print(f"Saved login information for user {colr(username, Role.USER)}; if this is {red('incorrect')}, run {colr('bgg -l', Role.COMMAND)} to login again!")
-        return creds     
-        
 def get_games(name):
     pattern = '[^a-zA-Z0-9\s]'
-    response = requests.get(f'{bgg_api}/search?query={re.sub(pattern, "", name).replace(" ", "%20")}&exact=0&type=boardgame')
+    response = transport.get(f'{bgg_api}/search?query={re.sub(pattern, "", name).replace(" ", "%20")}&exact=0&type=boardgame')
 
     if response:
-        response = xmltodict.parse(response.content)
+        with tracing.span("parse", what="search"):
+            response = xmltodict.parse(response.content)
         total = int(response.get('items', {}).get('@total'))
         
         if total == 0: return []
         else:
-            return [{'name': item.get('name', {}).get('@value'), 'year': item.get('yearpublished', {}).get('@value'), 'idx':item.get('@id')} for item in ([response['items']['item']] if total == 1 else response['items']['item'])]
+            results = [{'name': item.get('name', {}).get('@value'), 'year': item.get('yearpublished', {}).get('@value'), 'idx':item.get('@id')} for item in ([response['items']['item']] if total == 1 else response['items']['item'])]
+            get_title_store().add(results)
+            return results
             
-def get_plays(days=30):
-    if not days: days = 0
-    date_offset = (datetime.datetime.now() - datetime.timedelta(days=days if days else 0)).strftime("%y-%m-%d")
+title_store = None
 
-    i = 0
-    all_plays = []
-    user = get_user()
-    while (response := requests.get(f"{bgg_api}/plays?username={user.get('username')}&played=1&page={(i := i+1)}{f'&mindate={date_offset}' if days > 0 else ''}")):
-        if "invalid object or user" in response.text.lower():
-            print(f"{colr('Could not find any plays', Role.ERROR)} for user {colr(user.get('username'), Role.USER)}. Try logging in with {colr('bgg -l', Role.COMMAND)}!")
-            exit(1)
+def get_title_store() -> TitleStore:
+    global title_store
+    if title_store is None:
+        title_store = TitleStore()
 
-        data = xmltodict.parse(response.content)
-        plays = data["plays"]["play"] if 'play' in data['plays'] else []
-        
-        all_plays += [{'date':p.get('@date'), 'plays':int(p.get("@quantity")), "name":p.get('item', {}).get('@name')} for p in plays if not isinstance(p, str)]
+    return title_store
+
+play_store = None
+
+def get_play_store() -> PlayStore:
+    global play_store
+    if play_store is None:
+        play_store = PlayStore()
+
+    return play_store
+
+def fetch_plays_page(username: str, page: int, min_date: Optional[str] = None) -> requests.Response:
+    response = transport.get(f"{bgg_api}/plays?username={username}&played=1&page={page}{f'&mindate={min_date}' if min_date else ''}")
+    if "invalid object or user" in response.text.lower():
+        print(f"{colr('Could not find any plays', Role.ERROR)} for user {colr(username, Role.USER)}. Try logging in with {colr('bgg -l', Role.COMMAND)}!")
+        exit(1)
+
+    response.raise_for_status()
+    return response
+
+def read_plays_page(username: str, page: int, min_date: Optional[str] = None, meta: Optional[dict] = None) -> List[dict]:
+    content = fetch_plays_page(username, page, min_date).content
+    with tracing.span("parse", what="plays"):
+        return list(xmlstream.iter_plays(io.BytesIO(content), meta))
+
+def remaining_plays_pages(meta: dict) -> range:
+    """The pages after the first, going by the total play count the first page reported in meta"""
+    return range(2, math.ceil(int(meta.get("total", 0)) / plays_page_size) + 1)
+
+def iter_plays(username: str, min_date: Optional[str] = None) -> Iterator[dict]:
+    meta = {}
+    yield from xmlstream.iter_plays(io.BytesIO(fetch_plays_page(username, 1, min_date).content), meta)
+
+    for page in remaining_plays_pages(meta):
+        yield from xmlstream.iter_plays(io.BytesIO(fetch_plays_page(username, page, min_date).content))
+
+def fetch_plays(username: str, min_date: Optional[str] = None, concurrency: int = concurrency) -> List[dict]:
+    # The first page reports the total play count, so every other page can be requested up-front
+    meta = {}
+    all_plays = read_plays_page(username, 1, min_date, meta)
+    pages = remaining_plays_pages(meta)
+
+    if pages:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            for plays in pool.map(lambda page: read_plays_page(username, page, min_date), pages):
+                all_plays += plays
 
     return all_plays
 
-def get_collection(username: str):
-    response = requests.get(f"{bgg_api}/collection?username={username}")
-    timeout = 1
-    while response.status_code != 200:
-        response = requests.get(f"{bgg_api}/collection?username={username}")
-        time.sleep(timeout)
-        timeout *= 2
+def sync_plays(
+    username: str, 
+    full: bool = False, 
+    max_age: float = 5 * 60, 
+    reconcile_age: float = 7 * 24 * 60 * 60
+):
+    """Brings the local play history up to date.
+
+    Only plays on or after the newest synced play date are fetched (mindate is inclusive, so that day's plays are
+    re-fetched and upserted by id). Edits and deletions of older plays are picked up by a full refetch every
+    reconcile_age seconds.
+    """
+    store = get_play_store()
+    state = store.state(username)
+    now = time.time()
+
+    if state is not None and httpcache.offline:
+        # The snapshot already holds everything that was ever fetched
+        return
+
+    if state is None or full or now - state["reconciled_at"] > reconcile_age:
+        plays = fetch_plays(username)
+        store.merge(username, plays, full=True)
+    elif now - state["synced_at"] > max_age:
+        plays = fetch_plays(username, min_date=state["newest_date"])
+        store.merge(username, plays)
+    else:
+        tracing.emit("cache", store="plays", hits=1)
+        return
+
+    tracing.emit("cache", store="plays", misses=1)
+
+    get_title_store().add({'idx': p['game_id'], 'name': p['name']} for p in plays if p['game_id'])
+
+def get_plays(days=30, sync: bool = True):
+    user = get_user()
+    if sync:
+        sync_plays(user)
+
+    since = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime("%Y-%m-%d") if days else None
+    return get_play_store().plays(user, since)
+
+def get_play_columns(days=30, sync: bool = True) -> Dict[str, list]:
+    """Like get_plays, but only name, date and plays as parallel lists (see playtable.PlayTable.from_columns)"""
+    user = get_user()
+    if sync:
+        sync_plays(user)
+
+    since = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime("%Y-%m-%d") if days else None
+    return get_play_store().columns(user, since)
+
+collection_store = None
+
+def get_collection_store() -> CollectionStore:
+    global collection_store
+    if collection_store is None:
+        collection_store = CollectionStore()
+
+    return collection_store
+
+def iter_collection(username: str, modified_since: Optional[str] = None, cache: bool = True) -> Iterator[CollectionItem]:
+    url = f"{bgg_api}/collection?username={username}"
+    if modified_since:
+        url += f"&modifiedsince={quote(modified_since)}"
+
+    # The first request for a collection is usually answered with a 202 while BGG builds the export; the transport
+    # keeps polling until it's ready. Storing the response in the cache reads the whole body first, so pass
+    # cache=False to parse it straight off the socket
+    with transport.get(url, stream=True, cache=cache) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        yield from xmlstream.iter_collection(response.raw)
+
+def fetch_collection(username: str, modified_since: Optional[str] = None) -> List[CollectionItem]:
+    # The export is parsed as it streams in, so this includes the time spent waiting on the body
+    with tracing.span("parse", what="collection (streamed)"):
+        return list(iter_collection(username, modified_since))
+
+def sync_collection(
+    username: str, 
+    full: bool = False, 
+    max_age: float = 5 * 60, 
+    reconcile_age: float = 24 * 60 * 60
+) -> CollectionDiff:
+    """Brings the local snapshot up to date, returning what changed since the last sync.
+
+    Snapshots younger than max_age are served as-is; otherwise only items modified since the newest
+    lastmodified timestamp we've seen are fetched. Deletions aren't reported by modifiedsince, so a full
+    fetch is done every reconcile_age seconds (or when forced).
+    """
+    store = get_collection_store()
+    state = store.state(username)
+    now = time.time()
+
+    if state is not None and httpcache.offline:
+        return CollectionDiff()
+
+    if state is None or full or now - state["reconciled_at"] > reconcile_age:
+        diff = store.merge(username, fetch_collection(username), full=True)
+    elif now - state["synced_at"] > max_age:
+        diff = store.merge(username, fetch_collection(username, modified_since=state["modified"]))
+    else:
+        tracing.emit("cache", store="collection", hits=1)
+        return CollectionDiff()
     
-    owned, wishlist = [], []
-    collection = xmltodict.parse(response.content)
-    if "items" not in collection:
-        return owned, wishlist
-
-    for item in collection["items"]["item"]:
-        model = CollectionItem(
-            id=int(item["@collid"]),
-            comment=item.get("comment"),
-            game=Game(name=item["name"]["#text"], id=item["@objectid"])
-        )
+    tracing.emit("cache", store="collection", misses=1)
+    get_title_store().add({'idx': i.game.id, 'name': i.game.name} for i in diff.added + diff.changed)
+    return diff
+
+def get_collection(username: str, sync: bool = True) -> Tuple[List[CollectionItem], List[CollectionItem]]:
+    if sync:
+        sync_collection(username)
 
+    owned, wishlist = [], []
+    for item in get_collection_store().items(username):
         # These are technically not mutually exclusive categories for BGG, but treating as if they are. This will
         # break things in the exceedingly rare case where a game is both owned AND wishlisted...oh well
-        if item["status"]["@own"] == "1":
-            model.owned = True
-            owned.append(model)
-        elif item["status"]["@wishlist"] == "1":
-            model.owned = False
-            model.wishlist = WishlistMetadata(
-                priority=int(item["status"].get("@wishlistpriority", 0)),
-                comment=item.get("wishlistcomment")
-            )
-            
-            wishlist.append(model)
+        if item.owned:
+            item.wishlist = None
+            owned.append(item)
+        elif item.wishlist is not None:
+            wishlist.append(item)
     
     return owned, wishlist
 
-def get_game(id: Union[int, str]):
-    retries = 0
-    while retries < 5:
-        response = requests.get(f"{bgg_api}/thing?id={id}&thingtype=boardgame&stats=1")
-        if not response.content: 
-            return None
-        
-        returned = xmltodict.parse(response.content)
-        
-        # BGG sometimes spuriously returns an error response without particular cause (doesn't appear to be rate limit),
-        # so simply sleep and retry
-        if "error" in returned:
-            print(f"Received error attempting to get ID {id}: {returned['error']}; retrying...")
-            retries += 1
-            time.sleep(1)
-        else:
-            content = returned["items"]["item"]
-            break
-    else:
-        return None
-
+def get_collections(
+    usernames: Iterable[str], 
+    sync: bool = True, 
+    concurrency: int = concurrency
+) -> Dict[str, Tuple[List[CollectionItem], List[CollectionItem]]]:
+    """get_collection for several users at once; BGG queues each export separately, so they're waited on in parallel"""
+    usernames = list(dict.fromkeys(usernames))
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        return dict(zip(usernames, pool.map(lambda u: get_collection(u, sync=sync), usernames)))
+
+game_store = None
+
+def get_game_store() -> GameStore:
+    global game_store
+    if game_store is None:
+        game_store = GameStore()
+
+    return game_store
+
+def get_game(id: Union[int, str], refresh: bool = False):
+    games = get_games_by_id([id], refresh=refresh)
+    return games.get(int(id))
+
+def get_games_by_id(
+    ids: Iterable[Union[int, str]], 
+    batch_size: int = 20, 
+    retries: int = 5, 
+    refresh: bool = False
+) -> Dict[int, Game]:
+    ids = list(dict.fromkeys(int(i) for i in ids))
+    games = {} if refresh else get_game_store().get_many(ids)
+    
+    missing = [i for i in ids if i not in games]
+    tracing.emit("cache", store="games", hits=len(games), misses=len(missing))
+    pending = [missing[i:i+batch_size] for i in range(0, len(missing), batch_size)]
+
+    attempt = 0
+    while pending and attempt < retries:
+        failed = []
+        for chunk in pending:
+            try:
+                response = transport.get(f"{bgg_api}/thing?id={','.join(map(str, chunk))}&thingtype=boardgame&stats=1")
+            except transport.OfflineError:
+                # Whatever isn't stored or cached just goes without metadata
+                continue
+
+            if not response.content:
+                continue
+
+            with tracing.span("parse", what="games (xml)"):
+                returned = xmltodict.parse(response.content) if response.status_code == 200 else None
+
+            # BGG sometimes spuriously returns an error response without particular cause (doesn't appear to be rate limit),
+            # so only the chunks that failed are retried
+            if returned is None or "error" in returned:
+                print(f"Received error attempting to get IDs {chunk}: {returned['error'] if returned else response.status_code}; retrying...")
+                failed.append(chunk)
+                continue
+
+            items = returned.get("items", {}).get("item", [])
+            with tracing.span("parse", what="games (model)"):
+                fetched = [parse_game(content) for content in (items if isinstance(items, list) else [items])]
+            get_game_store().put(fetched)
+            games.update((int(game.id), game) for game in fetched)
+
+        pending = failed
+        attempt += 1
+        if pending:
+            time.sleep(transport.policy.delay(attempt))
+
+    return games
+
+def parse_game(content: dict) -> Game:
     best_with, recommended_counts = None, []
-    for result in content["poll-summary"]["result"]:
+    results = content.get("poll-summary", {}).get("result", [])
+    for result in (results if isinstance(results, list) else [results]):
         if result.get("@name") in ["bestwith", "recommmendedwith"]:
             bounds = "".join(result["@value"].split(" ")[2:-1]).rstrip("+")
             if "," not in bounds:
@@ -152,19 +327,19 @@ def get_game(id: Union[int, str]):
             elif result.get("@name") == "recommmendedwith":
                 recommended_counts = output
     
-    return Game(**{
+    return Game.canonical(**{
         # Assume the English title is first index
         "name": content["name"][0]["@value"] if isinstance(content["name"], list) else content["name"]["@value"],
-        "id": content["@id"],
-        "player_minimum": content['minplayers']["@value"],
-        "player_maximum": content['maxplayers']["@value"],
+        "id": int(content["@id"]),
+        "player_minimum": int(content['minplayers']["@value"]),
+        "player_maximum": int(content['maxplayers']["@value"]),
         "player_best": best_with,
         "player_recommended": recommended_counts,
         "complexity": round(float(content["statistics"]["ratings"]["averageweight"]["@value"]), 2)
     })
 
 @authenticated_request
-def wishlist_game(gid: int, name: str, priority: int, comment: Optional[str] = None, BGG_SESSION: Optional[requests.Session] = None):
+def wishlist_game(gid: int, name: str, priority: int, comment: Optional[str] = None, BGG_SESSION: Optional[session.SessionManager] = None):
     request_body = {"item": {
         "collid": 0,
         "pp_currency": "USD",
@@ -181,11 +356,14 @@ def wishlist_game(gid: int, name: str, priority: int, comment: Optional[str] = N
     if comment:
         request_body["item"]["textfield"] = {"wishlistcomment": {"value": comment}}
 
-    BGG_SESSION.post(
-        "https://boardgamegeek.com/api/collectionitems",
+    response = BGG_SESSION.post(
+        f"{bgg_site}/api/collectionitems",
         data=json.dumps(request_body),
         headers={'content-type': 'application/json'}
     )
+    response.raise_for_status()
+    httpcache.get_cache().mutated()
+    get_collection_store().invalidate()
 
 @authenticated_request
 def update_status(
@@ -195,7 +373,7 @@ def update_status(
     prev_owned: bool = False,
     trade: Optional[bool] = None,
     wishlist_priority: Optional[int] = None, 
-    BGG_SESSION: Optional[requests.Session] = None
+    BGG_SESSION: Optional[session.SessionManager] = None
 ):
     
     request_body = {
@@ -212,25 +390,31 @@ def update_status(
         "action": "savedata",
     }
 
-    BGG_SESSION.post(
-        "https://boardgamegeek.com/geekcollection.php",
+    response = BGG_SESSION.post(
+        f"{bgg_site}/geekcollection.php",
         data=request_body,
         headers={'content-type': 'application/x-www-form-urlencoded'}
     )
+    response.raise_for_status()
+    httpcache.get_cache().mutated()
+    get_collection_store().set_status(cid, owned, wishlist_priority)
 
 @authenticated_request
-def delete_item(cid: int, BGG_SESSION: Optional[requests.Session] = None):
+def delete_item(cid: int, BGG_SESSION: Optional[session.SessionManager] = None):
     request_body = {
         "collid": cid,
         "ajax": 1,
         "action": "delete",
     }
 
-    BGG_SESSION.post(
-        "https://boardgamegeek.com/geekcollection.php",
+    response = BGG_SESSION.post(
+        f"{bgg_site}/geekcollection.php",
         data=request_body,
         headers={'content-type': 'application/x-www-form-urlencoded'}
     )
+    response.raise_for_status()
+    httpcache.get_cache().mutated()
+    get_collection_store().delete(cid)
 
 @authenticated_request
 def update_comment(
@@ -238,7 +422,7 @@ def update_comment(
     gid: int, 
     comment: str="", 
     wishlist: bool=False, 
-    BGG_SESSION: Optional[requests.Session] = None
+    BGG_SESSION: Optional[session.SessionManager] = None
 ):    
     request_body = {
         "fieldname": "comment" if not wishlist else "wishlistcomment",
@@ -250,20 +434,24 @@ def update_comment(
         "action": "savedata",
     }
 
-    BGG_SESSION.post(
-        "https://boardgamegeek.com/geekcollection.php",
+    response = BGG_SESSION.post(
+        f"{bgg_site}/geekcollection.php",
         data=request_body,
         headers={'content-type': 'application/x-www-form-urlencoded'}
     )
+    response.raise_for_status()
+    httpcache.get_cache().mutated()
+    get_collection_store().set_comment(cid, comment, wishlist)
 
 @authenticated_request
-def log_play(gid, plays=1, comment="", BGG_SESSION: Optional[requests.Session] = None):
+def log_play(gid, plays=1, comment="", playdate: Optional[str] = None, BGG_SESSION: Optional[session.SessionManager] = None):
     if BGG_SESSION is None:
         print("This request must be authenticated!")
         return False
     
+    playdate = playdate or datetime.datetime.now().strftime("%Y-%m-%d")
     playload = {
-        "playdate": datetime.datetime.now().strftime("%Y-%m-%d"),
+        "playdate": playdate,
         "objectid": f"{gid}",
         "objecttype":"thing",
         "action":"save",
@@ -271,13 +459,19 @@ def log_play(gid, plays=1, comment="", BGG_SESSION: Optional[requests.Session] =
         "comments": comment
     }
 
-    response = BGG_SESSION.post(
-        "https://boardgamegeek.com/geekplay.php", 
-        data=json.dumps(playload), 
-        headers={'content-type': 'application/json'}
-    )
+    try:
+        response = BGG_SESSION.post(
+            f"{bgg_site}/geekplay.php", 
+            data=json.dumps(playload), 
+            headers={'content-type': 'application/json'}
+        )
+    except session.AuthenticationError:
+        return 401
 
     res_text = response.text.lower()
+    # A play queued on an earlier day can be older than the newest synced one
+    get_play_store().invalidate(playdate)
+    httpcache.get_cache().mutated()
 
     if "you must login to save plays" in res_text:
         return 401
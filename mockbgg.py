@@ -0,0 +1,366 @@
+# A local stand-in for BoardGameGeek, for measuring link without hammering the real site. It serves the XML API
+# endpoints we use (/search, /thing, /plays, /collection, including the 202 "queued" dance) plus login and the
+# geekcollection.php/geekplay.php/collectionitems mutation endpoints, all backed by synthetic fixtures. Latency,
+# server errors and throttling can be injected.
+#
+#   python mockbgg.py --plays 10000 --items 5000 --latency 0.05
+#   BGG_API=http://127.0.0.1:8080/xmlapi2 BGG_SITE=http://127.0.0.1:8080 python bgg.py -s
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape, quoteattr
+
+adjectives = ["Ancient", "Burning", "Crimson", "Distant", "Endless", "Forgotten", "Golden", "Hidden", "Iron", "Lost",
+              "Mystic", "Northern", "Obsidian", "Painted", "Quiet", "Rising", "Silent", "Twilight", "Wandering", "Wild"]
+nouns = ["Empires", "Harbors", "Kingdoms", "Lanterns", "Meadows", "Orchards", "Railways", "Rivers", "Settlers", "Spires",
+         "Stars", "Temples", "Towers", "Trails", "Vineyards", "Voyages", "Wonders", "Forests", "Castles", "Canals"]
+
+plays_page_size = 100
+
+class Fixtures:
+    def __init__(self, plays: int = 10000, items: int = 5000, games: Optional[int] = None, seed: int = 0):
+        rng = random.Random(seed)
+        games = games or max(items, 500)
+
+        self.games = {}
+        for gid in range(1, games + 1):
+            minimum = rng.randint(1, 3)
+            maximum = minimum + rng.randint(0, 5)
+            self.games[gid] = {
+                "id": gid,
+                "name": f"{adjectives[gid % len(adjectives)]} {nouns[(gid // len(adjectives)) % len(nouns)]}" +
+                        (f" {gid // (len(adjectives) * len(nouns))}" if gid >= len(adjectives) * len(nouns) else ""),
+                "year": rng.randint(1980, 2022),
+                "min": minimum,
+                "max": maximum,
+                "best": rng.randint(minimum, maximum),
+                "weight": round(rng.uniform(1, 5), 4),
+            }
+
+        # BGG lists plays newest first
+        self.plays = sorted((
+            {
+                "id": i + 1,
+                "date": f"{rng.randint(2015, 2022)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}",
+                "quantity": rng.choice([1, 1, 1, 2, 3]),
+                "game": rng.randint(1, games),
+                "comments": f"Comment for play {i + 1}" if rng.random() < 0.3 else None,
+                "players": [f"Player {rng.randint(1, 12)}" for _ in range(rng.randint(1, 5))],
+            } for i in range(plays)
+        ), key=lambda p: (p["date"], p["id"]), reverse=True)
+
+        self.items = {}
+        for i, gid in enumerate(rng.sample(range(1, games + 1), min(items, games))):
+            wishlist = rng.random() < 0.2
+            self.items[100000 + i] = {
+                "collid": 100000 + i,
+                "game": gid,
+                "own": not wishlist,
+                "wishlist": wishlist,
+                "priority": rng.randint(1, 5),
+                "comment": rng.choice([None, "[Audit]", "[Loaned: Alice]", "[Audit][Loaned: Bob]", "Sleeved"]),
+                "wishlistcomment": "Maybe" if wishlist and rng.random() < 0.5 else None,
+                "modified": f"2022-{rng.randint(1, 12):02}-{rng.randint(1, 28):02} 12:00:00",
+            }
+
+        self._lock = threading.Lock()
+
+    def search_xml(self, query: str) -> str:
+        words = query.lower().split()
+        matches = [g for g in self.games.values() if all(w in g["name"].lower() for w in words)]
+        items = "".join(
+            f'<item type="boardgame" id="{g["id"]}"><name type="primary" value={quoteattr(g["name"])}/>'
+            f'<yearpublished value="{g["year"]}"/></item>'
+            for g in matches
+        )
+        return f'<?xml version="1.0" encoding="utf-8"?><items total="{len(matches)}" termsofuse="">{items}</items>'
+
+    def thing_xml(self, ids: List[int]) -> str:
+        items = "".join(
+            f'<item type="boardgame" id="{g["id"]}"><name type="primary" sortindex="1" value={quoteattr(g["name"])}/>'
+            f'<yearpublished value="{g["year"]}"/><minplayers value="{g["min"]}"/><maxplayers value="{g["max"]}"/>'
+            f'<poll-summary name="suggested_numplayers" title="User Suggested Number of Players">'
+            f'<result name="bestwith" value="Best with {g["best"]} players"/>'
+            f'<result name="recommmendedwith" value="Recommended with {g["min"]}–{g["max"]} players"/></poll-summary>'
+            f'<statistics page="1"><ratings><usersrated value="1000"/><average value="7.2"/>'
+            f'<averageweight value="{g["weight"]}"/></ratings></statistics></item>'
+            for g in (self.games.get(i) for i in ids) if g
+        )
+        return f'<?xml version="1.0" encoding="utf-8"?><items termsofuse="">{items}</items>'
+
+    def plays_xml(self, username: str, page: int, mindate: Optional[str] = None, page_size: int = plays_page_size) -> str:
+        with self._lock:
+            plays = [p for p in self.plays if not mindate or p["date"] >= mindate]
+
+        chunk = plays[(page - 1) * page_size:page * page_size]
+        body = "".join(
+            f'<play id="{p["id"]}" date="{p["date"]}" quantity="{p["quantity"]}" length="0" incomplete="0" '
+            f'nowinstats="0" location=""><item name={quoteattr(self.games[p["game"]]["name"])} objecttype="thing" '
+            f'objectid="{p["game"]}"><subtypes><subtype value="boardgame"/></subtypes></item>'
+            + (f'<comments>{escape(p["comments"])}</comments>' if p["comments"] else "") +
+            '<players>' + "".join(
+                f'<player username="" userid="0" name={quoteattr(name)} startposition="" color="" score="" new="0" '
+                f'rating="0" win="0"/>' for name in p["players"]
+            ) + '</players></play>'
+            for p in chunk
+        )
+        return (
+            f'<?xml version="1.0" encoding="utf-8"?><plays username={quoteattr(username)} userid="1" '
+            f'total="{len(plays)}" page="{page}" termsofuse="">{body}</plays>'
+        )
+
+    def collection_xml(self, modifiedsince: Optional[str] = None, stats: bool = False) -> str:
+        with self._lock:
+            items = [i for i in self.items.values() if not modifiedsince or i["modified"] >= modifiedsince]
+
+        def item_xml(item: dict) -> str:
+            g = self.games[item["game"]]
+            return (
+                f'<item objecttype="thing" objectid="{g["id"]}" subtype="boardgame" collid="{item["collid"]}">'
+                f'<name sortindex="1">{escape(g["name"])}</name><yearpublished>{g["year"]}</yearpublished>'
+                f'<thumbnail>https://cf.geekdo-images.com/{g["id"]}_t.jpg</thumbnail>' +
+                (
+                    f'<stats minplayers="{g["min"]}" maxplayers="{g["max"]}" playingtime="60" numowned="1000">'
+                    f'<rating value="N/A"><usersrated value="1000"/><average value="7.2"/><bayesaverage value="6.9"/>'
+                    f'<ranks><rank type="subtype" id="1" name="boardgame" friendlyname="Board Game Rank" '
+                    f'value="{g["id"]}" bayesaverage="6.9"/></ranks></rating></stats>' if stats else ""
+                ) +
+                f'<status own="{int(item["own"])}" prevowned="0" fortrade="0" want="0" wanttoplay="0" wanttobuy="0" '
+                f'wishlist="{int(item["wishlist"])}" wishlistpriority="{item["priority"]}" preordered="0" '
+                f'lastmodified="{item["modified"]}"/><numplays>0</numplays>' +
+                (f'<comment>{escape(item["comment"])}</comment>' if item["comment"] else "") +
+                (f'<wishlistcomment>{escape(item["wishlistcomment"])}</wishlistcomment>' if item["wishlistcomment"] else "") +
+                '</item>'
+            )
+
+        return (
+            f'<?xml version="1.0" encoding="utf-8"?><items totalitems="{len(items)}" termsofuse="" pubdate="">'
+            + "".join(item_xml(i) for i in items) + '</items>'
+        )
+
+    def now(self) -> str:
+        return time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def update_item(self, form: Dict[str, str]):
+        with self._lock:
+            item = self.items.get(int(form.get("collid", 0)))
+            if item is None:
+                return
+
+            if form.get("action") == "delete":
+                del self.items[item["collid"]]
+                return
+            elif form.get("fieldname") == "status":
+                item["own"] = form.get("own") == "1"
+                item["wishlist"] = form.get("wishlist") == "1"
+                item["priority"] = int(form.get("wishlistpriority", 1))
+            elif form.get("fieldname") in ("comment", "wishlistcomment"):
+                item[form["fieldname"]] = form.get("value")
+
+            item["modified"] = self.now()
+
+    def add_item(self, body: dict):
+        with self._lock:
+            collid = max(self.items, default=100000) + 1
+            self.items[collid] = {
+                "collid": collid,
+                "game": int(body["objectid"]),
+                "own": False,
+                "wishlist": True,
+                "priority": int(body.get("wishlistpriority", 1)),
+                "comment": None,
+                "wishlistcomment": body.get("textfield", {}).get("wishlistcomment", {}).get("value"),
+                "modified": self.now(),
+            }
+
+    def log_play(self, body: dict):
+        with self._lock:
+            self.plays.insert(0, {
+                "id": max((p["id"] for p in self.plays), default=0) + 1,
+                "date": body.get("playdate"),
+                "quantity": int(body.get("quantity", 1)),
+                "game": int(body["objectid"]),
+                "comments": body.get("comments") or None,
+                "players": [],
+            })
+
+class Options:
+    def __init__(self, latency: float = 0, jitter: float = 0, error_rate: float = 0, throttle_rate: float = 0, queue: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.queue = queue
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "MockServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status: int, body: str = "", content_type: str = "text/xml; charset=utf-8", headers: Optional[dict] = None):
+        data = body.encode()
+        if self.command == "GET" and status == 200:
+            # Lets clients revalidate with If-None-Match, as a server supporting conditional requests would
+            etag = f'"{hashlib.md5(data).hexdigest()}"'
+            headers = {**(headers or {}), "ETag": etag}
+            if self.headers.get("If-None-Match") == etag:
+                status, data = 304, b""
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def injected(self) -> bool:
+        """Applies latency and, sometimes, an injected failure; True if the request has already been answered"""
+        options = self.server.options
+        self.server.count(self.path)
+
+        if options.latency or options.jitter:
+            time.sleep(max(0, options.latency + random.uniform(-options.jitter, options.jitter)))
+
+        roll = random.random()
+        if roll < options.throttle_rate:
+            self.send(429, "Rate limit exceeded", "text/plain", {"Retry-After": "1"})
+            return True
+        elif roll < options.throttle_rate + options.error_rate:
+            self.send(503, "Service unavailable", "text/plain")
+            return True
+
+        return False
+
+    def authenticated(self) -> bool:
+        return f"SessionID={self.server.session_id}" in (self.headers.get("Cookie") or "")
+
+    def do_GET(self):
+        if self.injected():
+            return
+
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        fixtures = self.server.fixtures
+
+        if url.path.endswith("/search"):
+            self.send(200, fixtures.search_xml(query.get("query", "")))
+        elif url.path.endswith("/thing"):
+            ids = [int(i) for i in query.get("id", "").split(",") if i]
+            if len(ids) > 20:
+                self.send(200, '<?xml version="1.0" encoding="utf-8"?><error><message>Cannot load more than 20 items</message></error>')
+            else:
+                self.send(200, fixtures.thing_xml(ids))
+        elif url.path.endswith("/plays"):
+            if not query.get("username"):
+                self.send(200, "<div class='messagebox error'>Invalid object or user</div>", "text/html")
+            else:
+                self.send(200, fixtures.plays_xml(query["username"], int(query.get("page", 1)), query.get("mindate")))
+        elif url.path.endswith("/collection"):
+            # The first requests for a given export are queued, as on BGG
+            if self.server.queued(url.query):
+                self.send(202, '<?xml version="1.0" encoding="utf-8"?><message>Your request for this collection has been accepted and will be processed.  Please try again later for access.</message>')
+            else:
+                self.send(200, fixtures.collection_xml(query.get("modifiedsince"), query.get("stats") == "1"))
+        else:
+            self.send(404, "Not found", "text/plain")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length).decode()
+        if self.injected():
+            return
+
+        path = urlparse(self.path).path
+        if path == "/login/api/v1":
+            credentials = json.loads(raw or "{}").get("credentials", {})
+            if credentials.get("username") and credentials.get("password"):
+                self.send(204, "", "text/plain", {"Set-Cookie": f"SessionID={self.server.session_id}; Path=/"})
+            else:
+                self.send(401, '{"errors":{"message":"Invalid username or password"}}', "application/json")
+        elif path == "/geekplay.php":
+            if not self.authenticated():
+                self.send(200, '{"error":"You must login to save plays"}', "application/json")
+            else:
+                self.server.fixtures.log_play(json.loads(raw))
+                self.send(200, '{"playid":"1","numplays":1,"html":""}', "application/json")
+        elif path == "/geekcollection.php":
+            if not self.authenticated():
+                self.send(401, "You must login", "text/plain")
+            else:
+                self.server.fixtures.update_item({k: v[0] for k, v in parse_qs(raw).items()})
+                self.send(200, "", "text/html")
+        elif path == "/api/collectionitems":
+            if not self.authenticated():
+                self.send(401, '{"errors":{"message":"You must login"}}', "application/json")
+            else:
+                self.server.fixtures.add_item(json.loads(raw)["item"])
+                self.send(200, "{}", "application/json")
+        else:
+            self.send(404, "Not found", "text/plain")
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], fixtures: Fixtures, options: Options):
+        super().__init__(address, Handler)
+        self.fixtures = fixtures
+        self.options = options
+        self.session_id = f"{random.getrandbits(64):x}"
+        self.requests: Dict[str, int] = {}
+        self._queue: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, path: str):
+        endpoint = urlparse(path).path.rsplit("/", 1)[-1]
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def queued(self, key: str) -> bool:
+        with self._lock:
+            seen = self._queue.get(key, 0)
+            self._queue[key] = seen + 1
+            return seen < self.options.queue
+
+def start(fixtures: Optional[Fixtures] = None, options: Optional[Options] = None, host: str = "127.0.0.1", port: int = 0) -> MockServer:
+    """Starts a mock server on a background thread; point BGG_API at server.url + '/xmlapi2' and BGG_SITE at server.url"""
+    server = MockServer((host, port), fixtures or Fixtures(), options or Options())
+    threading.Thread(target=server.serve_forever, name="mockbgg", daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='mockbgg', description="Local stand-in for the BoardGameGeek API")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--plays', type=int, default=10000, help="number of synthetic plays")
+    parser.add_argument('--items', type=int, default=5000, help="number of synthetic collection items")
+    parser.add_argument('--latency', type=float, default=0, help="added latency per request, in seconds")
+    parser.add_argument('--jitter', type=float, default=0, help="random +/- variation on the latency, in seconds")
+    parser.add_argument('--error-rate', type=float, default=0, help="fraction of requests answered with a 503")
+    parser.add_argument('--throttle-rate', type=float, default=0, help="fraction of requests answered with a 429")
+    parser.add_argument('--queue', type=int, default=1, help="number of 202 responses before a collection is ready")
+    args = parser.parse_args()
+
+    server = MockServer(
+        ("127.0.0.1", args.port),
+        Fixtures(args.plays, args.items),
+        Options(args.latency, args.jitter, args.error_rate, args.throttle_rate, args.queue)
+    )
+    print(f"Serving mock BoardGameGeek at {server.url} (BGG_API={server.url}/xmlapi2 BGG_SITE={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,3 +1,5 @@
+import weakref
+
 from typing import Optional, List
 
 class Game:
@@ -9,17 +11,40 @@ class Game:
     player_recommended: Optional[List[int]]
     complexity: Optional[float]
 
+    fields = (
+        "name", 
+        "id", 
+        "player_minimum", 
+        "player_maximum", 
+        "player_best", 
+        "player_recommended",
+        "complexity"
+    )
+    __slots__ = fields + ("__weakref__",)
+
+    # Identity map: every live Game for a given BGG id is the same object, so metadata fetched for one view of a game
+    # (e.g. get_game) is visible from every other (collection items, search results, ...)
+    _instances = weakref.WeakValueDictionary()
+
     def __init__(self, **kwargs):
-        for field in [
-            "name", 
-            "id", 
-            "player_minimum", 
-            "player_maximum", 
-            "player_best", 
-            "player_recommended",
-            "complexity"
-        ]:
-            self.__dict__[field] = kwargs.get(field)
+        for field in Game.fields:
+            setattr(self, field, kwargs.get(field))
+
+    @classmethod
+    def canonical(cls, **kwargs) -> "Game":
+        gid = int(kwargs["id"])
+        game = cls._instances.get(gid)
+        if game is None:
+            game = cls._instances[gid] = cls(**{**kwargs, "id": gid})
+        else:
+            game.update(**kwargs)
+
+        return game
+
+    def update(self, **kwargs):
+        for field in Game.fields:
+            if kwargs.get(field) is not None:
+                setattr(self, field, kwargs[field])
 
     def __str__(self):
         return f"{self.name} @ {self.id}"
@@ -31,8 +56,8 @@ class Game:
         return "[Plays: {}–{}][Best: {}][Rec: {}][Cx: {}]".format(
             metadata.player_minimum,
             metadata.player_maximum,
-            ", ".join(map(str, metadata.player_best)),
-            ", ".join(map(str, metadata.player_recommended)),
+            ", ".join(map(str, metadata.player_best or [])),
+            ", ".join(map(str, metadata.player_recommended or [])),
             metadata.complexity
         )
 
@@ -40,9 +65,11 @@ class WishlistMetadata:
     priority: int
     comment: Optional[str]
 
+    __slots__ = ("priority", "comment")
+
     def __init__(self, **kwargs):
-        for field in ["priority", "comment"]:
-            self.__dict__[field] = kwargs.get(field)
+        for field in WishlistMetadata.__slots__:
+            setattr(self, field, kwargs.get(field))
 
 class CollectionItem:
     game: Game
@@ -51,21 +78,85 @@ class CollectionItem:
     giveaway: Optional[bool]
     comment: Optional[str]
     wishlist: Optional[WishlistMetadata]
+    modified: Optional[str]
+
+    __slots__ = (
+        "id",
+        "game",
+        "comment",
+        "owned",
+        "wishlist",
+        "giveaway",
+        "modified"
+    )
 
     def __init__(self, **kwargs):
-        for field in [
-            "id",
-            "game",
-            "comment",
-            "owned",
-            "wishlist",
-            "giveaway"
-        ]:
-            self.__dict__[field] = kwargs.get(field)
+        for field in CollectionItem.__slots__:
+            setattr(self, field, kwargs.get(field))
     
     def __str__(self):
         return str(self.game)
 
     def __repr__(self):
         return repr(self.game)
-        
+
+    def state(self) -> tuple:
+        return (
+            self.game.id,
+            self.comment,
+            self.owned,
+            self.wishlist.priority if self.wishlist else None,
+            self.wishlist.comment if self.wishlist else None
+        )
+
+class CollectionDiff:
+    added: List[CollectionItem]
+    removed: List[CollectionItem]
+    changed: List[CollectionItem]
+
+    __slots__ = ("added", "removed", "changed")
+
+    def __init__(self, **kwargs):
+        for field in CollectionDiff.__slots__:
+            setattr(self, field, kwargs.get(field) or [])
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __str__(self):
+        return f"+{len(self.added)} -{len(self.removed)} ~{len(self.changed)}"
+
+# Plain-JSON encoding of the models, for handing them between processes (see daemon.py)
+def encode(value):
+    if isinstance(value, Game):
+        return {"__game__": {field: getattr(value, field) for field in Game.fields}}
+    elif isinstance(value, CollectionItem):
+        return {"__item__": {field: encode(getattr(value, field)) for field in CollectionItem.__slots__}}
+    elif isinstance(value, WishlistMetadata):
+        return {"__wishlist__": {field: getattr(value, field) for field in WishlistMetadata.__slots__}}
+    elif isinstance(value, CollectionDiff):
+        return {"__diff__": {field: encode(getattr(value, field)) for field in CollectionDiff.__slots__}}
+    elif isinstance(value, dict):
+        return {"__dict__": [[encode(k), encode(v)] for k, v in value.items()]}
+    elif isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+
+    return value
+
+def decode(value):
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    elif not isinstance(value, dict):
+        return value
+    elif "__game__" in value:
+        return Game.canonical(**value["__game__"])
+    elif "__item__" in value:
+        return CollectionItem(**{k: decode(v) for k, v in value["__item__"].items()})
+    elif "__wishlist__" in value:
+        return WishlistMetadata(**value["__wishlist__"])
+    elif "__diff__" in value:
+        return CollectionDiff(**{k: decode(v) for k, v in value["__diff__"].items()})
+    elif "__dict__" in value:
+        return {decode(k): decode(v) for k, v in value["__dict__"]}
+
+    return value
@@ -0,0 +1,45 @@
+# Cross-user ownership for `bgg --lookup alice bob ...`. Every looked-up collection is downloaded once and folded into
+# game id -> owners (and -> wishers) sets, so questions like "owned by any/all of us", "owned by exactly one of us" or
+# "on my wishlist and owned by one of them" are set operations rather than more downloads.
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from model import CollectionItem, Game
+
+class OwnershipIndex:
+    def __init__(self, collections: Dict[str, Tuple[List[CollectionItem], List[CollectionItem]]]):
+        self.users: List[str] = list(collections)
+        self.games: Dict[int, Game] = {}
+        self.owners: Dict[int, Set[str]] = {}
+        self.wishers: Dict[int, Set[str]] = {}
+
+        for user, (owned, wishlist) in collections.items():
+            self.add(user, owned, self.owners)
+            self.add(user, wishlist, self.wishers)
+
+    def add(self, user: str, items: Iterable[CollectionItem], index: Dict[int, Set[str]]):
+        for item in items:
+            gid = int(item.game.id)
+            self.games.setdefault(gid, item.game)
+            index.setdefault(gid, set()).add(user)
+
+    def owned_by(self, user: str) -> Set[int]:
+        return {gid for gid, owners in self.owners.items() if user in owners}
+
+    def wanted_by(self, user: str) -> Set[int]:
+        return {gid for gid, wishers in self.wishers.items() if user in wishers}
+
+    def owned_by_any(self, users: Optional[Iterable[str]] = None) -> Set[int]:
+        users = set(users or self.users)
+        return {gid for gid, owners in self.owners.items() if owners & users}
+
+    def owned_by_all(self, users: Optional[Iterable[str]] = None) -> Set[int]:
+        users = set(users or self.users)
+        return {gid for gid, owners in self.owners.items() if users <= owners}
+
+    def owned_by_exactly(self, count: int, users: Optional[Iterable[str]] = None) -> Set[int]:
+        users = set(users or self.users)
+        return {gid for gid, owners in self.owners.items() if len(owners & users) == count}
+
+    def sorted(self, gids: Iterable[int]) -> List[Game]:
+        return sorted((self.games[gid] for gid in gids), key=lambda game: (game.name or "").lower())
@@ -1,37 +1,83 @@
-import link
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
-from collections import Counter
-from math import log
-
-def std(date_string): return datetime.strptime(date_string, "%Y-%m-%d")
-def play_plot(days=365):
-    plays = link.get_plays(days)
-    by_game = {}
-    for p in plays:
-        if p['name'] in by_game: by_game[p['name']].extend([std(p['date'])]*p['plays'])
-        else: by_game[p['name']] = [std(p['date'])]
+import argparse
+
+import numpy as np
+
+from datetime import datetime
+from typing import Optional
+
+from playtable import PlayTable
+
+colors = ['red', 'orange', '#FADA5e', 'green', 'blue', 'indigo', 'violet']
+
+def plot_title(days: Optional[int]) -> str:
+    if not days:
+        span = "All Time"
+    elif -5 <= days - 365 <= 5:
+        span = "Past Year"
+    else:
+        span = f"Past {days} Day" + ('s' if days != 1 else '')
+
+    return f"Game Plays, {span} [Size ∝ Plays]"
+
+def render(table: PlayTable, days: Optional[int] = 365, output: Optional[str] = None):
+    """Draws one scatter per game (marker size and alpha scale with plays that day); saves to output if given"""
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import to_rgba_array
+
+    games, dates, counts = table.by_game_and_period("D")
+
+    # Group each game's points together, most played dates first so single plays are drawn on top
+    order = np.lexsort((-counts, games))
+    games, dates, counts = games[order], dates[order], counts[order]
+    # Where each game's run of points starts and ends; both are empty when nothing was played in the window
+    starts = np.flatnonzero(np.diff(games, prepend=-1))
+    ends = np.append(starts[1:], len(games))[:len(starts)]
 
     fig, ax = plt.subplots()
-    plt.title(f"Game Plays, Past {'Year' if -5 <= days - 365 <= 5 else f'{days} Day'+('s' if days != 1 else '')} [Size ∝ Plays]")
-    plt.winter()
+    plt.title(plot_title(days))
     plt.xticks(rotation=45)
-    plt.yticks(weight='bold')
     plt.xlabel("Date")
-    colors = ['red', 'orange', '#FADA5e', 'green', 'blue', 'indigo', 'violet']
-    for i, [game, dates] in enumerate(by_game.items()):
-        date_count = Counter(dates)
-        for date, count in sorted(list(date_count.items()), key=lambda c: c[1])[::-1]:
-            ax.plot_date(date, game, ms=5+count, alpha=1 if count == 1 else max(1/(0.8*count), 0.5), color=colors[i % len(colors)])
 
+    # Colors are built as one RGBA array up-front; per-point alpha otherwise goes through to_rgba point by point
+    rows = np.repeat(np.arange(len(starts)), ends - starts)
+    rgba = to_rgba_array(colors)[rows % len(colors)]
+    rgba[:, 3] = np.where(counts == 1, 1.0, np.maximum(1 / (0.8 * counts), 0.5))
+    sizes = (5 + counts) ** 2
+    x = mdates.date2num(dates.astype("datetime64[D]"))
+    for row, (start, end) in enumerate(zip(starts, ends)):
+        ax.scatter(x[start:end], rows[start:end], s=sizes[start:end], c=rgba[start:end], linewidths=0)
+
+    ax.xaxis_date()
+
+    ax.set_yticks(range(len(starts)))
+    ax.set_yticklabels([table.names[games[start]] for start in starts], weight='bold')
     for i, ytick in enumerate(ax.get_yticklabels()):
         ytick.set_color(colors[i % len(colors)])
 
     ax.set_xlim(right=datetime.today())
+    fig.autofmt_xdate()
+
+    if output:
+        fig.savefig(output, bbox_inches="tight")
+        plt.close(fig)
+    else:
+        plt.show()
 
-    gcf = plt.gcf()
-    gcf.autofmt_xdate()
-    plt.show()
+def play_plot(days: Optional[int] = 365, output: Optional[str] = None):
+    if output:
+        # Render straight to a file without needing a display (or the GUI toolkit) at all
+        import matplotlib
+        matplotlib.use("Agg")
+
+    import link
+
+    render(PlayTable.from_columns(link.get_play_columns(days)), days, output)
 
 if __name__ == '__main__':
-    play_plot()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Plot logged plays per game over time")
+    parser.add_argument('days', nargs='?', type=int, default=365, help="number of days to plot (0 for full history)")
+    parser.add_argument('-o', '--output', help="write the plot to a .png or .svg file instead of showing it")
+    args = parser.parse_args()
+
+    play_plot(args.days or None, args.output)
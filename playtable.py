@@ -0,0 +1,117 @@
+# Play history held column-wise for summaries and plots. Game names are interned to small integer codes and dates,
+# codes and quantities live in parallel NumPy arrays, so grouping is a bincount and filtering is a boolean mask rather
+# than a Python loop over play dicts; tens of thousands of plays summarize in a few milliseconds.
+
+import datetime
+
+import numpy as np
+
+from typing import Dict, List, Optional, Tuple, Union
+
+Date = Union[str, datetime.date, np.datetime64]
+
+# datetime64 day 0 (1970-01-01) was a Thursday
+_monday_offset = 3
+
+class PlayTable:
+    __slots__ = ("names", "game", "date", "quantity")
+
+    def __init__(self, names: np.ndarray, game: np.ndarray, date: np.ndarray, quantity: np.ndarray):
+        self.names = names
+        self.game = game
+        self.date = date
+        self.quantity = quantity
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, list]) -> "PlayTable":
+        """Builds a table from parallel name/date/plays lists (see PlayStore.columns)"""
+        # Interning through a dict is several times faster than np.unique's sort over strings
+        codes: Dict[str, int] = {}
+        game = np.fromiter((codes.setdefault(name, len(codes)) for name in columns["name"]), np.int32, len(columns["name"]))
+        return cls(
+            np.array(list(codes), dtype=str),
+            game,
+            np.array(columns["date"], dtype="datetime64[D]"),
+            np.array(columns["plays"], dtype=np.int32),
+        )
+
+    @classmethod
+    def from_plays(cls, plays: List[dict]) -> "PlayTable":
+        return cls.from_columns({
+            "name": [p["name"] or "" for p in plays],
+            "date": [p["date"] for p in plays],
+            "plays": [p["plays"] for p in plays],
+        })
+
+    def __len__(self) -> int:
+        return len(self.game)
+
+    @property
+    def total(self) -> int:
+        return int(self.quantity.sum())
+
+    def _where(self, mask: np.ndarray) -> "PlayTable":
+        return PlayTable(self.names, self.game[mask], self.date[mask], self.quantity[mask])
+
+    def between(self, start: Optional[Date] = None, end: Optional[Date] = None) -> "PlayTable":
+        """Plays from start up to and including end"""
+        mask = np.ones(len(self), dtype=bool)
+        if start is not None:
+            mask &= self.date >= np.datetime64(start, "D")
+        if end is not None:
+            mask &= self.date <= np.datetime64(end, "D")
+        return self._where(mask)
+
+    def matching(self, text: str) -> "PlayTable":
+        """Plays of games whose name contains text (case-insensitive)"""
+        if not text:
+            return self
+
+        keep = np.char.find(np.char.lower(self.names), text.lower()) >= 0
+        return self._where(keep[self.game])
+
+    def by_game(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(names, total plays) for every game played at least once"""
+        totals = np.bincount(self.game, weights=self.quantity, minlength=len(self.names)).astype(np.int64)
+        played = totals > 0
+        return self.names[played], totals[played]
+
+    def by_period(self, unit: str = "M") -> Tuple[np.ndarray, np.ndarray]:
+        """(period start dates, total plays) per month ("M"), Monday-based week ("W") or day ("D")"""
+        periods = self.periods(unit)
+        starts, index = np.unique(periods, return_inverse=True)
+        return starts, np.bincount(index, weights=self.quantity).astype(np.int64)
+
+    def by_game_and_period(self, unit: str = "D") -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(game codes, period start dates, total plays) for every game/period pair with plays"""
+        periods = self.periods(unit)
+        if not len(periods):
+            return self.game, periods, self.quantity.astype(np.int64)
+
+        # Pack each (game, day offset) pair into one integer key so a single unique/bincount does the grouping
+        first = periods.min()
+        offsets = (periods - first).astype(np.int64)
+        span = offsets.max() + 1
+        keys, index = np.unique(self.game.astype(np.int64) * span + offsets, return_inverse=True)
+        totals = np.bincount(index, weights=self.quantity).astype(np.int64)
+        return (keys // span).astype(np.int32), first + (keys % span).astype("timedelta64[D]"), totals
+
+    def periods(self, unit: str) -> np.ndarray:
+        """The first day of the month/week/day each play falls in"""
+        if unit == "W":
+            days = self.date.astype(np.int64) + _monday_offset
+            return (days - days % 7 - _monday_offset).astype("datetime64[D]")
+
+        return self.date.astype(f"datetime64[{unit}]").astype("datetime64[D]")
+
+    def ranked(self, by: str = "plays") -> List[Tuple[str, int]]:
+        """Per-game totals, most played first (ties by title) or alphabetically, ignoring a leading "The" """
+        names, totals = self.by_game()
+        if not len(names):
+            return []
+
+        titles = np.char.lower(names)
+        titles = np.where(np.char.startswith(titles, "the "), np.char.replace(titles, "the ", "", 1), titles)
+
+        order = np.lexsort((titles, -totals)) if by == "plays" else np.argsort(titles, kind="stable")
+        return [(str(names[i]), int(totals[i])) for i in order]
@@ -0,0 +1,89 @@
+# Background metadata prefetch for the `-c` and `-w` menus. As soon as a list is shown, game metadata for every item
+# is fetched in batches on a background thread, starting with the items around the cursor, so picking an item opens
+# its action menu without waiting on /thing (or on the retry backoff after one of BGG's spurious errors).
+
+import threading
+
+from typing import Dict, Iterable, List, Optional, Set
+
+from model import Game
+
+class Prefetcher:
+    def __init__(self, api, ids: Iterable[int], batch_size: int = 20):
+        self.api = api
+        self.batch_size = batch_size
+        self.games: Dict[int, Optional[Game]] = {}
+        self._ids: List[int] = []
+        self._focus = 0
+        self._inflight: Set[int] = set()
+        self._closed = False
+        self._changed = threading.Condition()
+
+        self.show(ids)
+        self._worker = threading.Thread(target=self._run, name="prefetch", daemon=True)
+        self._worker.start()
+
+    def show(self, ids: Iterable[int]):
+        """Sets the list being shown, e.g. after it's been re-sorted"""
+        with self._changed:
+            self._ids = [int(i) for i in ids]
+            self._changed.notify_all()
+
+    def focus(self, index: int):
+        """Moves the cursor, so that the items around it are fetched next"""
+        with self._changed:
+            self._focus = index
+            self._changed.notify_all()
+
+    def get(self, id: int) -> Optional[Game]:
+        """Metadata for one game, waiting on the background fetch if it's already under way"""
+        id = int(id)
+        with self._changed:
+            while id in self._inflight:
+                self._changed.wait()
+            if self.games.get(id) is not None:
+                return self.games[id]
+
+        game = self.api.get_game(id)
+        if game is not None:
+            with self._changed:
+                self.games[id] = game
+        return game
+
+    def status(self, index: int) -> str:
+        """For a menu's status bar: focuses on the highlighted item and shows its metadata once it's in"""
+        self.focus(index)
+        with self._changed:
+            game = self.games.get(self._ids[index]) if 0 <= index < len(self._ids) else None
+        return game.format_metadata() if game is not None else ""
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    def _next_batch(self) -> List[int]:
+        with self._changed:
+            pending = [
+                (abs(position - self._focus), id) for position, id in enumerate(self._ids)
+                if id not in self.games and id not in self._inflight
+            ]
+            batch = [id for _, id in sorted(pending)[:self.batch_size]]
+            self._inflight.update(batch)
+            return batch
+
+    def _run(self):
+        while not self._closed and (batch := self._next_batch()):
+            try:
+                games = self.api.get_games_by_id(batch)
+            except Exception:
+                # Whatever didn't make it is fetched on demand by get() instead
+                games = {}
+
+            with self._changed:
+                self.games.update((int(id), game) for id, game in games.items())
+                self._inflight.difference_update(batch)
+                # Don't keep retrying games BGG didn't return; get() will ask again if they're picked
+                for id in batch:
+                    self.games.setdefault(id, None)
+                self._changed.notify_all()
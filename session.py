@@ -0,0 +1,133 @@
+# A single authenticated BoardGameGeek session, shared by every mutation in the process. Logging in is expensive
+# (a JSON POST plus a fresh TLS handshake), so the cookie jar is persisted to disk and reused across runs until it
+# expires or BGG tells us we've been logged out, at which point we transparently log in again.
+
+import json
+import os
+import threading
+import time
+
+import requests
+
+import transport
+
+from transport import pooled_session
+from utils import bgg_site, creds_path, session_path
+
+login_url = f"{bgg_site}/login/api/v1"
+
+class AuthenticationError(Exception):
+    pass
+
+def needs_login(response: requests.Response) -> bool:
+    return response.status_code == 401 or "you must login" in response.text.lower()
+
+class SessionManager:
+    def __init__(self, credentials: str = creds_path, jar: str = session_path):
+        self.credentials = credentials
+        self.jar = jar
+        self._session = None
+        self._lock = threading.RLock()
+        # The credentials file as of the current session; `bgg -l` rewrites it, and a long-lived process (`bgg serve`)
+        # has to notice that rather than keep posting as the previous account
+        self._credentials_stamp = None
+        # Bumped on every login, so threads that hit the same expired session only log in once between them
+        self._generation = 0
+
+    @property
+    def session(self) -> requests.Session:
+        with self._lock:
+            if self._session is not None and self._credentials_stamp != self._stamp():
+                self._session = None
+
+            if self._session is None:
+                self._credentials_stamp = self._stamp()
+                self._session = pooled_session()
+                if not self._load_cookies():
+                    self.login()
+
+            return self._session
+
+    def login(self):
+        with self._lock:
+            if self._session is None:
+                self._session = pooled_session()
+
+            self._session.cookies.clear()
+            self._credentials_stamp = self._stamp()
+            with open(self.credentials) as jf:
+                response = transport.post(
+                    login_url,
+                    session=self._session,
+                    data=json.dumps({"credentials": json.load(jf)}),
+                    headers={'content-type': 'application/json'}
+                )
+
+            if not response.ok:
+                raise AuthenticationError(f"Login failed with status {response.status_code}")
+
+            self._save_cookies()
+            self._generation += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._session = None
+            try:
+                os.remove(self.jar)
+            except FileNotFoundError:
+                pass
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        with self._lock:
+            session, generation = self.session, self._generation
+
+        response = transport.post(url, session=session, **kwargs)
+        if needs_login(response):
+            with self._lock:
+                # Another thread may have logged in while this request was in flight; its cookies will do
+                if self._generation == generation:
+                    self.login()
+            response = transport.post(url, session=self.session, **kwargs)
+
+        return response
+
+    def _stamp(self):
+        try:
+            return os.stat(self.credentials).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load_cookies(self) -> bool:
+        try:
+            with open(self.jar) as jf:
+                cookies = json.load(jf)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+
+        now = time.time()
+        # Any expired cookie means BGG will treat the jar as logged out, so don't bother with a partial restore
+        if not cookies or any(c.get("expires") is not None and c["expires"] <= now for c in cookies):
+            return False
+
+        for c in cookies:
+            self._session.cookies.set(
+                c["name"], c["value"],
+                domain=c.get("domain"), path=c.get("path", "/"),
+                expires=c.get("expires"), secure=c.get("secure", False)
+            )
+
+        return True
+
+    def _save_cookies(self):
+        os.makedirs(os.path.dirname(self.jar), exist_ok=True)
+        with open(self.jar, 'w') as jf:
+            json.dump([{
+                "name": c.name,
+                "value": c.value,
+                "domain": c.domain,
+                "path": c.path,
+                "expires": c.expires,
+                "secure": c.secure
+            } for c in self._session.cookies], jf)
+
+manager = SessionManager()
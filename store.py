@@ -0,0 +1,466 @@
+# Local SQLite storage for data that changes rarely on BGG's end (game metadata, etc.), so that the CLI can answer
+# most questions without a network round trip. Each thread gets its own connection; the database runs in WAL mode
+# so that concurrent readers (and the odd concurrent bgg process) don't block each other.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from typing import Dict, Iterable, List, Optional
+
+from model import Game, CollectionItem, CollectionDiff, WishlistMetadata
+from utils import cache_path, db_path
+
+_local = threading.local()
+
+def connection(path: str = db_path) -> sqlite3.Connection:
+    connections = _local.__dict__.setdefault("connections", {})
+    if path not in connections:
+        conn = sqlite3.connect(path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        connections[path] = conn
+
+    return connections[path]
+
+class GameStore:
+    ttl = 30 * 24 * 60 * 60
+
+    def __init__(self, path: str = db_path, ttl: Optional[float] = None):
+        self.path = path
+        if ttl is not None: self.ttl = ttl
+
+        with self.db as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS games (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    player_minimum INTEGER,
+                    player_maximum INTEGER,
+                    player_best TEXT,
+                    player_recommended TEXT,
+                    complexity REAL,
+                    fetched_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS game_counts (
+                    game_id INTEGER NOT NULL REFERENCES games(id) ON DELETE CASCADE,
+                    players INTEGER NOT NULL,
+                    best INTEGER NOT NULL,
+                    PRIMARY KEY (game_id, players)
+                );
+                CREATE INDEX IF NOT EXISTS games_players ON games(player_minimum, player_maximum);
+                CREATE INDEX IF NOT EXISTS games_complexity ON games(complexity);
+                CREATE INDEX IF NOT EXISTS game_counts_players ON game_counts(players, best);
+            """)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        return connection(self.path)
+
+    def get(self, gid: int) -> Optional[Game]:
+        return self.get_many([gid]).get(int(gid))
+
+    def get_many(self, ids: Iterable[int]) -> Dict[int, Game]:
+        ids = [int(i) for i in ids]
+        cutoff = time.time() - self.ttl
+
+        games = {}
+        # SQLite caps bound parameters, so look the ids up in slices
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i+500]
+            rows = self.db.execute(
+                f"SELECT * FROM games WHERE fetched_at >= ? AND id IN ({','.join('?' * len(chunk))})",
+                [cutoff, *chunk]
+            )
+            games.update((row["id"], self._to_game(row)) for row in rows)
+
+        return games
+
+    def put(self, games: Iterable[Game]):
+        now = time.time()
+        with self.db as db:
+            for game in games:
+                gid = int(game.id)
+                db.execute("""
+                    INSERT OR REPLACE INTO games
+                    (id, name, player_minimum, player_maximum, player_best, player_recommended, complexity, fetched_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    gid, game.name, game.player_minimum, game.player_maximum,
+                    json.dumps(game.player_best), json.dumps(game.player_recommended),
+                    game.complexity, now
+                ))
+
+                best = set(game.player_best or [])
+                db.execute("DELETE FROM game_counts WHERE game_id = ?", (gid,))
+                db.executemany(
+                    "INSERT OR REPLACE INTO game_counts (game_id, players, best) VALUES (?, ?, ?)",
+                    [(gid, p, p in best) for p in sorted(best | set(game.player_recommended or []))]
+                )
+
+    def query(
+        self,
+        players: Optional[int] = None,
+        best: bool = False,
+        min_complexity: Optional[float] = None,
+        max_complexity: Optional[float] = None
+    ) -> List[Game]:
+        clauses, params = [], []
+        if players is not None:
+            if best:
+                clauses.append("id IN (SELECT game_id FROM game_counts WHERE players = ? AND best = 1)")
+                params.append(players)
+            else:
+                clauses.append("player_minimum <= ? AND player_maximum >= ?")
+                params += [players, players]
+        if min_complexity is not None:
+            clauses.append("complexity >= ?")
+            params.append(min_complexity)
+        if max_complexity is not None:
+            clauses.append("complexity <= ?")
+            params.append(max_complexity)
+
+        rows = self.db.execute(
+            f"SELECT * FROM games {'WHERE ' + ' AND '.join(clauses) if clauses else ''} ORDER BY name",
+            params
+        )
+
+        return [self._to_game(row) for row in rows]
+
+    def _to_game(self, row: sqlite3.Row) -> Game:
+        return Game.canonical(
+            name=row["name"],
+            id=row["id"],
+            player_minimum=row["player_minimum"],
+            player_maximum=row["player_maximum"],
+            player_best=json.loads(row["player_best"]),
+            player_recommended=json.loads(row["player_recommended"]),
+            complexity=row["complexity"]
+        )
+
+class CollectionStore:
+    def __init__(self, path: str = db_path):
+        self.path = path
+
+        with self.db as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS collection (
+                    username TEXT NOT NULL,
+                    collid INTEGER NOT NULL,
+                    game_id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    comment TEXT,
+                    owned INTEGER NOT NULL,
+                    wishlist INTEGER NOT NULL,
+                    wishlist_priority INTEGER,
+                    wishlist_comment TEXT,
+                    modified TEXT,
+                    PRIMARY KEY (username, collid)
+                );
+                CREATE TABLE IF NOT EXISTS collection_sync (
+                    username TEXT PRIMARY KEY,
+                    synced_at REAL NOT NULL,
+                    reconciled_at REAL NOT NULL,
+                    modified TEXT
+                );
+            """)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        return connection(self.path)
+
+    def state(self, username: str) -> Optional[sqlite3.Row]:
+        return self.db.execute("SELECT * FROM collection_sync WHERE username = ?", (username.lower(),)).fetchone()
+
+    def items(self, username: str) -> List[CollectionItem]:
+        rows = self.db.execute(
+            "SELECT * FROM collection WHERE username = ? ORDER BY name COLLATE NOCASE", (username.lower(),)
+        )
+        return [self._to_item(row) for row in rows]
+
+    def merge(self, username: str, items: Iterable[CollectionItem], full: bool = False) -> CollectionDiff:
+        """Merges fetched items into the snapshot; a full fetch also removes anything no longer in the collection"""
+        username = username.lower()
+        existing = {item.id: item for item in self.items(username)}
+        diff = CollectionDiff()
+
+        with self.db as db:
+            seen = set()
+            for item in items:
+                seen.add(item.id)
+                previous = existing.get(item.id)
+                if previous is None:
+                    diff.added.append(item)
+                elif previous.state() != item.state():
+                    diff.changed.append(item)
+                else:
+                    continue
+
+                db.execute("""
+                    INSERT OR REPLACE INTO collection
+                    (username, collid, game_id, name, comment, owned, wishlist, wishlist_priority, wishlist_comment, modified)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    username, item.id, int(item.game.id), item.game.name, item.comment, bool(item.owned),
+                    item.wishlist is not None,
+                    item.wishlist.priority if item.wishlist else None,
+                    item.wishlist.comment if item.wishlist else None,
+                    item.modified
+                ))
+
+            if full:
+                diff.removed = [item for cid, item in existing.items() if cid not in seen]
+                db.executemany(
+                    "DELETE FROM collection WHERE username = ? AND collid = ?",
+                    [(username, item.id) for item in diff.removed]
+                )
+
+            now = time.time()
+            watermark = db.execute(
+                "SELECT MAX(modified) FROM collection WHERE username = ?", (username,)
+            ).fetchone()[0]
+
+            db.execute("""
+                INSERT INTO collection_sync (username, synced_at, reconciled_at, modified) VALUES (?, ?, ?, ?)
+                ON CONFLICT(username) DO UPDATE SET
+                    synced_at = excluded.synced_at,
+                    reconciled_at = CASE WHEN ? THEN excluded.reconciled_at ELSE reconciled_at END,
+                    modified = excluded.modified
+            """, (username, now, now, watermark, full))
+
+        return diff
+
+    # Local mutations are mirrored into the snapshot, so a re-run inside the freshness window sees them
+    def set_comment(self, cid: int, comment: str, wishlist: bool = False):
+        with self.db as db:
+            db.execute(
+                f"UPDATE collection SET {'wishlist_comment' if wishlist else 'comment'} = ? WHERE collid = ?",
+                (comment, cid)
+            )
+
+    def set_status(self, cid: int, owned: bool, wishlist_priority: Optional[int] = None):
+        with self.db as db:
+            db.execute(
+                "UPDATE collection SET owned = ?, wishlist = ?, wishlist_priority = ? WHERE collid = ?",
+                (owned, wishlist_priority is not None, wishlist_priority, cid)
+            )
+
+    def delete(self, cid: int):
+        with self.db as db:
+            db.execute("DELETE FROM collection WHERE collid = ?", (cid,))
+
+    def invalidate(self):
+        with self.db as db:
+            db.execute("UPDATE collection_sync SET synced_at = 0")
+
+    def _to_item(self, row: sqlite3.Row) -> CollectionItem:
+        return CollectionItem(
+            id=row["collid"],
+            comment=row["comment"],
+            owned=bool(row["owned"]),
+            game=Game.canonical(name=row["name"], id=row["game_id"]),
+            wishlist=WishlistMetadata(
+                priority=row["wishlist_priority"], 
+                comment=row["wishlist_comment"]
+            ) if row["wishlist"] else None,
+            modified=row["modified"]
+        )
+
+class PlayStore:
+    def __init__(self, path: str = db_path):
+        self.path = path
+
+        with self.db as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS plays (
+                    id INTEGER PRIMARY KEY,
+                    username TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    game_id INTEGER,
+                    name TEXT,
+                    comments TEXT,
+                    players TEXT
+                );
+                CREATE INDEX IF NOT EXISTS plays_user_date ON plays(username, date);
+                CREATE TABLE IF NOT EXISTS play_sync (
+                    username TEXT PRIMARY KEY,
+                    newest_date TEXT,
+                    newest_id INTEGER,
+                    synced_at REAL NOT NULL,
+                    reconciled_at REAL NOT NULL
+                );
+            """)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        return connection(self.path)
+
+    def state(self, username: str) -> Optional[sqlite3.Row]:
+        return self.db.execute("SELECT * FROM play_sync WHERE username = ?", (username.lower(),)).fetchone()
+
+    def plays(self, username: str, since: Optional[str] = None) -> List[dict]:
+        rows = self.db.execute(
+            "SELECT * FROM plays WHERE username = ? AND date >= ? ORDER BY date DESC, id DESC",
+            (username.lower(), since or "")
+        )
+
+        return [{
+            "id": row["id"],
+            "date": row["date"],
+            "plays": row["quantity"],
+            "game_id": row["game_id"],
+            "name": row["name"],
+            "comments": row["comments"],
+            "players": json.loads(row["players"] or "[]")
+        } for row in rows]
+
+    def columns(self, username: str, since: Optional[str] = None) -> Dict[str, list]:
+        """Game name, date and quantity of every play as parallel lists, for building a PlayTable"""
+        rows = self.db.execute(
+            "SELECT name, date, quantity FROM plays WHERE username = ? AND date >= ? ORDER BY date DESC, id DESC",
+            (username.lower(), since or "")
+        ).fetchall()
+
+        names, dates, quantities = zip(*rows) if rows else ((), (), ())
+        return {"name": [n or "" for n in names], "date": list(dates), "plays": list(quantities)}
+
+    def merge(self, username: str, plays: Iterable[dict], full: bool = False):
+        """Upserts fetched plays; a full fetch replaces the user's history so edits and deletions are picked up"""
+        username = username.lower()
+        now = time.time()
+
+        with self.db as db:
+            if full:
+                db.execute("DELETE FROM plays WHERE username = ?", (username,))
+
+            db.executemany("""
+                INSERT OR REPLACE INTO plays (id, username, date, quantity, game_id, name, comments, players)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(
+                p["id"], username, p["date"], p["plays"], p.get("game_id"), p["name"],
+                p.get("comments"), json.dumps(p.get("players") or [])
+            ) for p in plays])
+
+            newest = db.execute(
+                "SELECT date, id FROM plays WHERE username = ? ORDER BY date DESC, id DESC LIMIT 1", (username,)
+            ).fetchone()
+
+            db.execute("""
+                INSERT INTO play_sync (username, newest_date, newest_id, synced_at, reconciled_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(username) DO UPDATE SET
+                    newest_date = excluded.newest_date,
+                    newest_id = excluded.newest_id,
+                    synced_at = excluded.synced_at,
+                    reconciled_at = CASE WHEN ? THEN excluded.reconciled_at ELSE reconciled_at END
+            """, (username, newest["date"] if newest else None, newest["id"] if newest else None, now, now, full))
+
+    def invalidate(self, since: Optional[str] = None):
+        """Makes the next sync refetch; since (a play date) also lowers the watermark so a backdated play is picked up"""
+        with self.db as db:
+            db.execute("""
+                UPDATE play_sync SET synced_at = 0,
+                    newest_date = CASE WHEN ? IS NOT NULL AND newest_date > ? THEN ? ELSE newest_date END
+            """, (since, since, since))
+
+class TitleStore:
+    """Every game title we've come across (search results, collection items, plays), for offline title lookup"""
+    def __init__(self, path: str = db_path):
+        self.path = path
+
+        with self.db as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS titles (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    year TEXT
+                );
+            """)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        return connection(self.path)
+
+    def add(self, titles: Iterable[dict]):
+        with self.db as db:
+            # Search results are the only source with a year, so don't let a later yearless sighting erase it
+            db.executemany("""
+                INSERT INTO titles (id, name, year) VALUES (?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET name = excluded.name, year = COALESCE(excluded.year, year)
+            """, [(int(t["idx"]), t["name"], t.get("year")) for t in titles if t.get("name")])
+
+    def titles(self) -> List[dict]:
+        # Play frequency comes straight from the play history, if it's been synced
+        has_plays = self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'plays'").fetchone()
+        rows = self.db.execute(f"""
+            SELECT t.id, t.name, t.year, {'COALESCE(p.plays, 0)' if has_plays else '0'} AS plays FROM titles t
+            {'LEFT JOIN (SELECT game_id, SUM(quantity) AS plays FROM plays GROUP BY game_id) p ON p.game_id = t.id' if has_plays else ''}
+        """)
+
+        return [{"idx": str(row["id"]), "name": row["name"], "year": row["year"], "plays": row["plays"]} for row in rows]
+
+class SelectionStore:
+    """Which game each `bgg -a` title was resolved to and how many times in a row, replacing cache.json"""
+    def __init__(self, path: str = db_path, legacy: Optional[str] = cache_path):
+        self.path = path
+
+        with self.db as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS selections (
+                    title TEXT PRIMARY KEY,
+                    idx TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    year TEXT,
+                    count INTEGER NOT NULL
+                );
+            """)
+
+        if legacy and os.path.exists(legacy):
+            self.migrate(legacy)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        return connection(self.path)
+
+    def get(self, title: str) -> Optional[dict]:
+        row = self.db.execute("SELECT * FROM selections WHERE title = ?", (title,)).fetchone()
+        return dict(row) if row else None
+
+    def record(self, title: str, selected: dict):
+        """Counts another pick of a game for a title; picking a different game starts the count over"""
+        with self.db as db:
+            db.execute("""
+                INSERT INTO selections (title, idx, name, year, count) VALUES (?, ?, ?, ?, 1)
+                ON CONFLICT(title) DO UPDATE SET
+                    count = CASE WHEN idx = excluded.idx THEN count + 1 ELSE 1 END,
+                    idx = excluded.idx,
+                    name = excluded.name,
+                    year = excluded.year
+            """, (title, str(selected["idx"]), selected["name"], selected.get("year")))
+
+    def migrate(self, legacy: str):
+        """Imports an old cache.json (without overwriting anything recorded since) and moves it out of the way"""
+        try:
+            with open(legacy) as cf:
+                cache = json.load(cf)
+        except (OSError, ValueError):
+            return
+
+        with self.db as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO selections (title, idx, name, year, count) VALUES (?, ?, ?, ?, ?)",
+                [(title, str(c["idx"]), c["name"], c.get("year"), c.get("count", 1)) for title, c in cache.items()]
+            )
+
+        try:
+            os.replace(legacy, legacy + ".migrated")
+        except OSError:
+            # Another process got there first
+            pass
+
+    def clear(self):
+        with self.db as db:
+            db.execute("DELETE FROM selections")
@@ -7,7 +7,7 @@
 # The structure of a tag is one of: [Tag] | [Tag: Value]
 
 import re
-from typing import Dict, Optional, Union
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 from enum import Enum
 
 from model import CollectionItem
@@ -16,6 +16,9 @@ class TagType(Enum):
     LOANED = "Loaned"
     AUDIT = "Audit"
 
+_tag_types = {entry.value: entry for entry in TagType}
+_tag_pattern = re.compile(r"\[(.*?)\]")
+
 def modify_tags(coll_item: CollectionItem, tags: Dict[Union[TagType, str], str]):
     existing_tags = parse_tags(coll_item.comment)
     for t, v in tags.items():
@@ -23,7 +26,7 @@ def modify_tags(coll_item: CollectionItem, tags: Dict[Union[TagType, str], str])
 
     out_str = ""
     for tag, value in existing_tags.items():
-        out_tag = tag.value if isinstance(tag, TagType) else tag
+        out_tag = tag_name(tag)
         if isinstance(value, str):
             out_str += f"[{out_tag}: {value}]"
         elif value:
@@ -32,13 +35,15 @@ def modify_tags(coll_item: CollectionItem, tags: Dict[Union[TagType, str], str])
     return out_str
 
 def try_map(tag_str: str) -> Union[TagType, str]:
-    entries = {entry.value: entry for entry in list(TagType)}
-    return entries.get(tag_str, tag_str)
+    return _tag_types.get(tag_str, tag_str)
+
+def tag_name(tag: Union[TagType, str]) -> str:
+    return tag.value if isinstance(tag, TagType) else tag
 
 def parse_tags(s: Optional[str]):
     if not s: return {}
     
-    raw_tags = [tag.split(":") for tag in re.findall("\[(.*?)\]", s)]
+    raw_tags = [tag.split(":", 1) for tag in _tag_pattern.findall(s)]
     
     output_tags = {}
     for t in raw_tags:
@@ -49,3 +54,126 @@ def parse_tags(s: Optional[str]):
             output_tags[tag_name] = t[1].strip()
     
     return output_tags
+
+# Tag queries select collection items by their tags, e.g. `Loaned`, `Loaned=Alice`, `Audit AND NOT Loaned` or
+# `(Audit=Giveaway OR Loaned) AND NOT "To Sell"`. A colon works in place of `=`, as in the tags themselves
+# (`Loaned: Alice`). Commas are shorthand for AND, so the old `--filters a,b` form still works: a bare term that
+# isn't the name of any tag (e.g. `Alice` or `Sleeved`) falls back to a substring match on the whole comment, as
+# filters used to. Everything is matched case-insensitively.
+
+class TagQueryError(ValueError):
+    pass
+
+_token_pattern = re.compile(r'''\s*(?:(\()|(\))|(,)|([=:])|"([^"]*)"|([^\s(),=:"]+))''')
+
+def tokenize(query: str) -> List[Tuple[str, str]]:
+    tokens, position = [], 0
+    query = query.rstrip()
+    while position < len(query):
+        match = _token_pattern.match(query, position)
+        if not match:
+            raise TagQueryError(f"Unexpected {query[position:].strip()[:1]!r} in tag query {query!r}")
+
+        position = match.end()
+        opening, closing, comma, equals, quoted, word = match.groups()
+        if word is not None and word.upper() in ("AND", "OR", "NOT"):
+            tokens.append((word.upper(), word))
+        elif word is not None or quoted is not None:
+            tokens.append(("WORD", word if word is not None else quoted))
+        elif comma:
+            tokens.append(("AND", comma))
+        elif equals:
+            tokens.append(("=", equals))
+        else:
+            symbol = opening or closing
+            tokens.append((symbol, symbol))
+
+    return tokens
+
+class TagIndex:
+    """Maps tag names and tag values to the collection items carrying them, built once per collection load"""
+    def __init__(self, items: Iterable[CollectionItem]):
+        self.items: List[CollectionItem] = list(items)
+        self.by_tag: Dict[str, Set[int]] = {}
+        self.by_value: Dict[Tuple[str, str], Set[int]] = {}
+        self._comments = [(item.comment or "").lower() for item in self.items]
+
+        for position, item in enumerate(self.items):
+            for tag, value in parse_tags(item.comment).items():
+                tag = tag_name(tag).lower()
+                self.by_tag.setdefault(tag, set()).add(position)
+                if isinstance(value, str):
+                    self.by_value.setdefault((tag, value.lower()), set()).add(position)
+
+    def tagged(self, tag: Union[TagType, str], value: Optional[str] = None) -> Set[int]:
+        tag = tag_name(tag).lower()
+        if value is None:
+            return set(self.by_tag.get(tag, ()))
+        return set(self.by_value.get((tag, value.lower()), ()))
+
+    def mentioning(self, text: str) -> Set[int]:
+        """Items whose comment contains text anywhere, tagged or not"""
+        text = text.lower()
+        return {position for position, comment in enumerate(self._comments) if text in comment}
+
+    def select(self, query: str) -> List[CollectionItem]:
+        """Items matching a tag query, in collection order; an empty query matches everything"""
+        if not query.strip():
+            return list(self.items)
+
+        return [self.items[i] for i in sorted(self.evaluate(query))]
+
+    def evaluate(self, query: str) -> Set[int]:
+        tokens = tokenize(query)
+        position = 0
+
+        def peek() -> Optional[str]:
+            return tokens[position][0] if position < len(tokens) else None
+
+        def take(kind: str) -> str:
+            nonlocal position
+            if peek() != kind:
+                found = repr(tokens[position][1]) if position < len(tokens) else "end of query"
+                raise TagQueryError(f"Expected {kind if kind != 'WORD' else 'a tag'} but found {found} in tag query {query!r}")
+
+            position += 1
+            return tokens[position - 1][1]
+
+        # expression := term (OR term)*; term := factor (AND factor)*; factor := NOT factor | ( expression ) | tag [= value]
+        def expression() -> Set[int]:
+            result = term()
+            while peek() == "OR":
+                take("OR")
+                result |= term()
+            return result
+
+        def term() -> Set[int]:
+            result = factor()
+            while peek() == "AND":
+                take("AND")
+                result &= factor()
+            return result
+
+        def factor() -> Set[int]:
+            if peek() == "NOT":
+                take("NOT")
+                return set(range(len(self.items))) - factor()
+            if peek() == "(":
+                take("(")
+                result = expression()
+                take(")")
+                return result
+
+            tag = take("WORD")
+            if peek() == "=":
+                take("=")
+                return self.tagged(tag, take("WORD"))
+            if tag.lower() not in self.by_tag and tag.lower() not in (known.lower() for known in _tag_types):
+                return self.mentioning(tag)
+            return self.tagged(tag)
+
+        result = expression()
+        if position < len(tokens):
+            raise TagQueryError(f"Unexpected {tokens[position][1]!r} in tag query {query!r}")
+
+        return result
@@ -0,0 +1,96 @@
+# Offline title lookup for `bgg -a`. Every title we've seen is indexed by character trigrams, so typos, abbreviations
+# ("ttr" for Ticket to Ride) and partial titles can be resolved locally, ranked by how often each game has been played.
+# Only when nothing matches confidently do we need to fall back to BGG's /search.
+
+import math
+import re
+
+from collections import defaultdict
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Set
+
+from store import TitleStore
+
+_non_alnum = re.compile(r"[^a-z0-9 ]+")
+
+def normalize(title: str) -> str:
+    title = _non_alnum.sub(" ", title.lower())
+    words = title.split()
+    if words and words[0] in ("the", "a", "an") and len(words) > 1:
+        words = words[1:]
+    return " ".join(words)
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+def acronym(text: str) -> str:
+    return "".join(word[0] for word in text.split())
+
+class TitleIndex:
+    confidence = 0.6
+
+    def __init__(self, store: Optional[TitleStore] = None):
+        self.store = store or TitleStore()
+        self.entries = self.store.titles()
+        self.names = [normalize(e["name"]) for e in self.entries]
+
+        self.grams: Dict[str, List[int]] = defaultdict(list)
+        for i, name in enumerate(self.names):
+            for gram in trigrams(name):
+                self.grams[gram].append(i)
+
+    def score(self, query: str, i: int, shared: int, query_grams: int) -> float:
+        name = self.names[i]
+        if name == query:
+            return 1.0
+
+        # Dice coefficient over trigrams handles reordered words, and an edit-based ratio handles typos in short
+        # titles where a single wrong letter wipes out most of the trigrams
+        score = max(
+            2 * shared / (query_grams + len(trigrams(name))),
+            0.9 * SequenceMatcher(None, query, name).ratio()
+        )
+
+        words = name.split()
+        query_words = query.split()
+        if name.startswith(query):
+            score = max(score, 0.75 + 0.25 * len(query) / len(name))
+        elif all(any(w.startswith(q) for w in words) for q in query_words):
+            score = max(score, 0.7)
+
+        return score
+
+    def search(self, title: str, limit: int = 10) -> List[dict]:
+        query = normalize(title)
+        if not query:
+            return []
+
+        query_grams = trigrams(query)
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for i in self.grams.get(gram, ()):
+                shared[i] += 1
+
+        # Abbreviations share hardly any trigrams with the title they stand for, so check those separately
+        if " " not in query and len(query) >= 2:
+            for i, name in enumerate(self.names):
+                if i not in shared and acronym(name) == query:
+                    shared[i] = 0
+
+        scored = []
+        for i, count in shared.items():
+            score = self.score(query, i, count, len(query_grams))
+            if count == 0 or acronym(self.names[i]) == query:
+                score = max(score, 0.8)
+
+            # Frequently played games win ties, but never outrank a clearly better textual match
+            rank = score + 0.02 * math.log1p(self.entries[i]["plays"])
+            scored.append((rank, score, i))
+
+        scored.sort(reverse=True)
+        return [{**self.entries[i], "score": score} for _, score, i in scored[:limit]]
+
+    def resolve(self, title: str, limit: int = 10) -> List[dict]:
+        """Returns local matches if any are confident enough to skip /search, else []"""
+        return [m for m in self.search(title, limit) if m["score"] >= self.confidence]
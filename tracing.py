@@ -0,0 +1,113 @@
+# Lightweight instrumentation for the link layer. The transport, stores and parsers emit events (one per HTTP
+# request, cache lookup or parse); nothing is recorded unless something has subscribed, so the hooks cost next to
+# nothing normally. `bgg --profile` summarizes the events per command, and `bgg --trace FILE` writes them out as JSON
+# lines for offline analysis.
+
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+from utils import *
+
+_listeners: List[Callable[[dict], None]] = []
+
+def subscribe(listener: Callable[[dict], None]):
+    _listeners.append(listener)
+
+def unsubscribe(listener: Callable[[dict], None]):
+    _listeners.remove(listener)
+
+def enabled() -> bool:
+    return bool(_listeners)
+
+def emit(kind: str, **fields):
+    if not _listeners:
+        return
+
+    event = {"kind": kind, "time": time.time(), "thread": threading.current_thread().name, **fields}
+    for listener in list(_listeners):
+        listener(event)
+
+@contextmanager
+def span(kind: str, **fields):
+    """Times the enclosed block and emits it as one event; fields can be added to the yielded dict along the way"""
+    if not _listeners:
+        yield fields
+        return
+
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        emit(kind, duration=time.perf_counter() - start, **fields)
+
+class JsonLines:
+    def __init__(self, path: str):
+        self.file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        with self._lock:
+            self.file.write(json.dumps(event, default=str) + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class Profile:
+    def __init__(self):
+        self.events: List[dict] = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+
+    def of(self, kind: str) -> List[dict]:
+        return [e for e in self.events if e["kind"] == kind]
+
+    def report(self, title: str) -> str:
+        elapsed = time.perf_counter() - self.started
+        lines = [f"{bold('Profile')}: {title} ({elapsed * 1000:.1f} ms)"]
+
+        requests = self.of("request")
+        if requests:
+            by_endpoint: Dict[str, List[dict]] = {}
+            for e in requests:
+                by_endpoint.setdefault(f"{e['method']} {e['endpoint']}", []).append(e)
+
+            total = sum(e["duration"] for e in requests)
+            lines.append(f"  {'requests':<36} {'count':>5} {'total':>10} {'bytes':>10} {'retries':>7}")
+            for endpoint, events in sorted(by_endpoint.items(), key=lambda i: -sum(e["duration"] for e in i[1])):
+                size = sum(e.get("bytes") or 0 for e in events)
+                lines.append(
+                    f"    {endpoint:<34} {len(events):>5} {sum(e['duration'] for e in events) * 1000:>7.1f} ms "
+                    f"{size / 1024:>7.1f} KiB {sum(e['retries'] for e in events):>7}"
+                )
+            lines.append(f"    {'(summed across threads)':<34} {'':>5} {total * 1000:>7.1f} ms")
+
+        caches = self.of("cache")
+        if caches:
+            lines.append(f"  {'caches':<36} {'hits':>5} {'misses':>6}")
+            by_store: Dict[str, List[int]] = {}
+            for e in caches:
+                counts = by_store.setdefault(e["store"], [0, 0])
+                counts[0] += e.get("hits", 0)
+                counts[1] += e.get("misses", 0)
+            for store, (hits, misses) in sorted(by_store.items()):
+                lines.append(f"    {store:<34} {hits:>5} {misses:>6}")
+
+        parses = self.of("parse")
+        if parses:
+            lines.append(f"  {'parsing':<36} {'count':>5} {'total':>10}")
+            by_what: Dict[str, List[dict]] = {}
+            for e in parses:
+                by_what.setdefault(e["what"], []).append(e)
+            for what, events in sorted(by_what.items()):
+                lines.append(f"    {what:<34} {len(events):>5} {sum(e['duration'] for e in events) * 1000:>7.1f} ms")
+
+        return "\n".join(lines)
@@ -0,0 +1,286 @@
+# Every request to BGG goes through here, so that the whole process shares one connection pool, one rate limit and
+# one idea of whether BGG is currently healthy. Reads are retried with jittered exponential backoff (including the
+# collection endpoint's 202 "request queued" responses and 429 throttling); mutations are only retried when BGG
+# definitely didn't act on them.
+
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from typing import Optional
+from urllib.parse import urlparse
+
+import httpcache
+import tracing
+
+retryable_statuses = {429, 500, 502, 503, 504}
+
+class TransportError(Exception):
+    pass
+
+class CircuitOpenError(TransportError):
+    pass
+
+class OfflineError(TransportError):
+    pass
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def drain(self, seconds: float):
+        """Pushes every caller back by the given amount, e.g. when BGG sends a Retry-After"""
+        with self._lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = 5, cooldown: float = 30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            elif time.monotonic() - self.opened_at < self.cooldown:
+                raise CircuitOpenError(f"BGG has failed {self.failures} times in a row; not retrying for {self.cooldown}s")
+
+            # Half-open: let the next request through, and re-open immediately if it fails too
+            self.opened_at = None
+            self.failures = self.threshold - 1
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+class RetryPolicy:
+    def __init__(self, base: float = 1, ceiling: float = 30, attempts: int = 8, deadline: float = 120):
+        self.base = base
+        self.ceiling = ceiling
+        self.attempts = attempts
+        self.deadline = deadline
+
+    def delay(self, attempt: int) -> float:
+        # "Full jitter": spreads out concurrent retries instead of having them all hit BGG at the same instant
+        return random.uniform(0, min(self.ceiling, self.base * 2 ** attempt))
+
+def pooled_session(pool_size: int = 8) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+limiter = TokenBucket(
+    rate=float(os.environ.get("BGG_RATE", 2)),
+    capacity=float(os.environ.get("BGG_BURST", 4))
+)
+breaker = CircuitBreaker()
+policy = RetryPolicy()
+timeout = 30
+
+_session = None
+_session_lock = threading.Lock()
+
+def default_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = pooled_session(pool_size=16)
+
+        return _session
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def traced(method: str, url: str, started: float, attempt: int, response: Optional[requests.Response], stream: bool):
+    if not tracing.enabled():
+        return
+
+    size = None
+    if response is not None:
+        # A streamed body hasn't been read yet, so go by what the server says it's sending
+        size = int(response.headers.get("Content-Length") or 0) or (None if stream else len(response.content))
+
+    tracing.emit(
+        "request",
+        method=method,
+        endpoint=urlparse(url).path,
+        status=response.status_code if response is not None else None,
+        duration=time.monotonic() - started,
+        bytes=size,
+        retries=attempt,
+    )
+
+def request(
+    method: str,
+    url: str,
+    session: Optional[requests.Session] = None,
+    idempotent: bool = True,
+    policy: RetryPolicy = policy,
+    cache: bool = True,
+    **kwargs
+) -> requests.Response:
+    """Sends a request, going through the response cache for GETs to endpoints it covers"""
+    if method == "GET" and cache and httpcache.get_cache().cacheable(url):
+        return cached_get(url, session, policy, **kwargs)
+    elif httpcache.offline:
+        raise OfflineError(f"Not sending {method} {url} while offline")
+
+    return send(method, url, session, idempotent, policy, **kwargs)
+
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+def cached_get(url: str, session: Optional[requests.Session], policy: RetryPolicy, **kwargs) -> requests.Response:
+    store = httpcache.get_cache()
+    entry = store.lookup(url)
+
+    if httpcache.offline:
+        if entry is None:
+            raise OfflineError(f"{url} hasn't been cached, so it can't be read offline")
+    elif entry is None or not store.usable_stale(entry):
+        tracing.emit("cache", store="http", misses=1)
+        return revalidate(url, entry, session, policy, **kwargs)
+    elif not store.fresh(entry):
+        with _revalidating_lock:
+            start = entry["key"] not in _revalidating
+            _revalidating.add(entry["key"])
+        if start:
+            threading.Thread(target=revalidate_later, args=(url, entry, session, policy), daemon=True).start()
+
+    tracing.emit("cache", store="http", hits=1)
+    return store.response(entry, url)
+
+def revalidate(url: str, entry, session: Optional[requests.Session], policy: RetryPolicy, **kwargs) -> requests.Response:
+    store = httpcache.get_cache()
+    if entry is not None:
+        kwargs["headers"] = {**(kwargs.get("headers") or {}), **store.conditional_headers(entry)}
+
+    try:
+        response = send("GET", url, session, True, policy, **kwargs)
+    except TransportError:
+        if entry is None:
+            raise
+        # An old answer beats no answer
+        return store.response(entry, url)
+
+    if response.status_code == 304 and entry is not None:
+        response.close()
+        store.refresh(entry)
+        return store.response(entry, url)
+    elif response.status_code == 200:
+        return store.store(url, response)
+
+    return response
+
+def revalidate_later(url: str, entry, session: Optional[requests.Session], policy: RetryPolicy):
+    try:
+        revalidate(url, entry, session, policy)
+    except Exception:
+        pass
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(entry["key"])
+
+def send(
+    method: str,
+    url: str,
+    session: Optional[requests.Session] = None,
+    idempotent: bool = True,
+    policy: RetryPolicy = policy,
+    **kwargs
+) -> requests.Response:
+    session = session or default_session()
+    kwargs.setdefault("timeout", timeout)
+    started = time.monotonic()
+
+    attempt = 0
+    while True:
+        breaker.check()
+        limiter.acquire()
+
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            breaker.failure()
+            # A mutation that was sent may well have been applied, so only retry it if it never connected
+            if not idempotent and not isinstance(e, requests.ConnectTimeout):
+                traced(method, url, started, attempt, None, False)
+                raise TransportError(f"{method} {url} failed: {e}") from e
+            error, wait = e, None
+        else:
+            if response.status_code == 202:
+                # The collection endpoint queues the export and wants us to come back later; not a failure
+                breaker.success()
+                error, wait = None, None
+            elif response.status_code == 429:
+                wait = retry_after(response)
+                limiter.drain(wait or policy.delay(attempt))
+                error = None
+            elif response.status_code in retryable_statuses and idempotent:
+                breaker.failure()
+                error, wait = None, retry_after(response)
+            else:
+                if response.status_code < 500:
+                    breaker.success()
+                else:
+                    breaker.failure()
+                traced(method, url, started, attempt, response, kwargs.get("stream", False))
+                return response
+
+            # Hand the connection back to the pool, which a streamed response otherwise holds on to
+            response.close()
+
+        attempt += 1
+        wait = wait if wait is not None else policy.delay(attempt)
+        if attempt >= policy.attempts or time.monotonic() - started + wait > policy.deadline:
+            traced(method, url, started, attempt, None, False)
+            raise TransportError(
+                f"Giving up on {method} {url} after {attempt} attempts" +
+                (f": {error}" if error else f" (last status {response.status_code})")
+            ) from error
+
+        time.sleep(wait)
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, idempotent=False, **kwargs)
@@ -5,6 +5,14 @@ from itertools import cycle
 
 cache_path = os.path.join(os.path.dirname(__file__), "cache.json")
 creds_path = os.path.join(os.path.dirname(__file__), "credentials", "bgg.json")
+session_path = os.path.join(os.path.dirname(__file__), "credentials", "session.json")
+db_path = os.path.join(os.path.dirname(__file__), "bgg.db")
+socket_path = os.path.join(os.path.dirname(__file__), "bgg.sock")
+http_cache_path = os.path.join(os.path.dirname(__file__), "http-cache.db")
+
+# Overridable so that everything can be pointed at a local stand-in (see mockbgg.py)
+bgg_site = os.environ.get("BGG_SITE", "https://boardgamegeek.com")
+bgg_api = os.environ.get("BGG_API", "https://api.geekdo.com/xmlapi2")
 
 ESC = "\033"
 DEFAULT = "\033[0m"
@@ -0,0 +1,60 @@
+# Incremental parsers for the larger XML API responses. Unlike xmltodict, which builds a nested dict of the whole
+# document before we pick out a handful of attributes, these walk the document with iterparse, yield one model per
+# <play>/<item> as soon as its closing tag is seen, and then throw the element away.
+
+import xml.etree.ElementTree as ET
+
+from typing import IO, Iterator, Optional
+
+from model import Game, CollectionItem, WishlistMetadata
+
+def _children(source: IO[bytes], tag: str, meta: Optional[dict]) -> Iterator[ET.Element]:
+    root = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if root is None:
+            root = elem
+            if meta is not None:
+                meta.update(root.attrib, tag=root.tag)
+        elif event == "end" and elem.tag == tag and elem in root:
+            yield elem
+            # Dropping the element from the root is what actually frees it; clear() alone leaves an empty shell behind
+            root.remove(elem)
+
+def iter_plays(source: IO[bytes], meta: Optional[dict] = None) -> Iterator[dict]:
+    """Yields plays from a /plays response; root attributes (e.g. total) are copied into meta if given"""
+    for play in _children(source, "play", meta):
+        item = play.find("item")
+        players = play.find("players")
+        objectid = item.get("objectid") if item is not None else None
+
+        yield {
+            'id': int(play.get('id')),
+            'date': play.get('date'),
+            'plays': int(play.get('quantity')),
+            'game_id': int(objectid) if objectid else None,
+            'name': item.get('name') if item is not None else None,
+            'comments': play.findtext('comments'),
+            'players': [
+                p.get('name') or p.get('username') for p in (players.iter('player') if players is not None else [])
+            ]
+        }
+
+def iter_collection(source: IO[bytes], meta: Optional[dict] = None) -> Iterator[CollectionItem]:
+    """Yields items from a /collection response; an error document (e.g. unknown user) yields nothing"""
+    for item in _children(source, "item", meta):
+        status = item.find("status")
+        model = CollectionItem(
+            id=int(item.get("collid")),
+            comment=item.findtext("comment"),
+            game=Game.canonical(name=item.findtext("name"), id=int(item.get("objectid"))),
+            owned=status.get("own") == "1",
+            modified=status.get("lastmodified")
+        )
+
+        if status.get("wishlist") == "1":
+            model.wishlist = WishlistMetadata(
+                priority=int(status.get("wishlistpriority", 0)),
+                comment=item.findtext("wishlistcomment")
+            )
+
+        yield model